@@ -0,0 +1,53 @@
+# Compares the incremental ARIMA strategy against refitting on every day, as decide() does.
+# Run from the repository root: python -m benchmarks.arima_refit [days] [p,d,q]
+import sys
+import time
+import numpy as np
+from statsmodels.tsa.arima.model import ARIMA
+from benchmarks import fake_vnstock
+
+# functions/ imports vnstock, so the fake keeps this check offline
+fake_vnstock.install()
+
+
+def full_refit_forecasts(rate, order):
+    forecasts = np.full(len(rate), np.nan)
+    for i in range(31, len(rate)):
+        forecasts[i] = ARIMA(rate[:i], order=order).fit().forecast(1)[0]
+    return forecasts
+
+
+def to_signals(forecasts):
+    return np.select([forecasts > 0.002, forecasts < -0.002], [1, -1], 0)
+
+
+def main(days=250, order=(1, 0, 1)):
+    from functions.simulation import arima_forecasts
+    rng = np.random.default_rng(0)
+    noise = rng.normal(0, 0.02, days)
+    rate = np.empty(days)
+    rate[0] = noise[0]
+    for i in range(1, days):
+        rate[i] = 0.3 * rate[i - 1] + noise[i]
+
+    start = time.perf_counter()
+    reference = full_refit_forecasts(rate, order)
+    reference_time = time.perf_counter() - start
+    scored = slice(31, days)
+    print(f'{days} days, order {order}')
+    print(f'{"mode":<28}{"seconds":>10}{"speedup":>10}{"rmse":>10}{"vs full":>10}{"signals":>10}')
+    print(f'{"full refit":<28}{reference_time:>10.2f}{1:>10.1f}{np.sqrt(np.mean((reference[scored] - rate[scored])**2)):>10.5f}{0:>10.5f}{1:>10.1%}')
+    for refit_every, window in [(1, None), (5, None), (20, None), (20, 120), (60, None)]:
+        start = time.perf_counter()
+        forecasts = arima_forecasts(rate, order, refit_every, window)
+        elapsed = time.perf_counter() - start
+        name = f'refit every {refit_every}' + (f', window {window}' if window else '')
+        rmse = np.sqrt(np.mean((forecasts[scored] - rate[scored])**2))
+        drift = np.max(np.abs(forecasts[scored] - reference[scored]))
+        agreement = np.mean(to_signals(forecasts[scored]) == to_signals(reference[scored]))
+        print(f'{name:<28}{elapsed:>10.2f}{reference_time / elapsed:>10.1f}{rmse:>10.5f}{drift:>10.5f}{agreement:>10.1%}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 250,
+         tuple(int(x) for x in sys.argv[2].split(',')) if len(sys.argv) > 2 else (1, 0, 1))
@@ -0,0 +1,63 @@
+# Checks that the vectorized engine (run_signals) makes the same trades and stats as the
+# bar-by-bar engine (run_decisions) on synthetic prices from fake_vnstock, and exits
+# non-zero if any backtest differs. ARIMA is left out: decide() refits on every bar, see
+# benchmarks/arima_refit.py.
+# Run from the repository root: python -m benchmarks.engine_parity [symbols]
+import itertools
+import os
+import sys
+import tempfile
+import numpy as np
+from benchmarks import fake_vnstock
+
+fake_vnstock.install()
+os.environ.setdefault('FINETIZE_DATA_DIR', tempfile.mkdtemp(prefix='finetize-parity-'))
+
+WINDOWS = {'1y': (365, '1D'), '5y': (5 * 365, '1D'), '90d 1H': (90, '1H')}
+STRATEGIES = ('Momentum', 'Mean Reversion')
+PERIODS = (1, 5, 20)
+POSITION_SIZINGS = (1, 0.3)
+COSTS = ('Default', 'HOSE')
+
+
+def ledger_mismatch(vectorized, loop):
+    # The first ledger field that differs, None if the two ledgers are identical
+    if len(vectorized) != len(loop):
+        return f'{len(vectorized)} vs {len(loop)} trades'
+    for field in vectorized.trades.dtype.names:
+        a = vectorized.trades[field].astype(float)
+        b = loop.trades[field].astype(float)
+        if not np.array_equal(a, b, equal_nan=True):
+            return f'{field} differs at trade {np.flatnonzero(~((a == b) | (np.isnan(a) & np.isnan(b))))[0]}'
+    return None
+
+
+def same_stats(a, b):
+    return a.keys() == b.keys() and all(a[key] == b[key] or (np.isnan(a[key]) and np.isnan(b[key])) for key in a)
+
+
+def main(symbols=3):
+    from functions.plots import get_stock_data
+    from functions.simulation import backtest
+    checked = failed = 0
+    for symbol, (window, (days_away, resolution)) in itertools.product(fake_vnstock.tickers(symbols), WINDOWS.items()):
+        prices = get_stock_data(symbol, days_away, resolution)['close']
+        for choice, period, position_sizing, costs in itertools.product(STRATEGIES, PERIODS, POSITION_SIZINGS, COSTS):
+            vectorized = backtest(choice, period, prices, 100_000_000, 0, position_sizing, engine='vectorized', costs=costs)
+            loop = backtest(choice, period, prices, 100_000_000, 0, position_sizing, engine='loop', costs=costs)
+            mismatch = ledger_mismatch(vectorized[0], loop[0])
+            if mismatch is None and vectorized[1:3] != loop[1:3]:
+                mismatch = f'cash or shares differ: {vectorized[1:3]} vs {loop[1:3]}'
+            if mismatch is None and not same_stats(vectorized[3], loop[3]):
+                mismatch = f'stats differ: {vectorized[3]} vs {loop[3]}'
+            checked += 1
+            if mismatch is not None:
+                failed += 1
+                print(f'{symbol} {window} {choice} {period} sizing {position_sizing} {costs}: {mismatch}')
+    print(f'{checked - failed}/{checked} backtests match')
+    if failed:
+        sys.exit(f'{failed} backtests differ between run_signals and run_decisions')
+
+
+if __name__ == '__main__':
+    main(*[int(n) for n in sys.argv[1:2]])
@@ -0,0 +1,102 @@
+# Offline stand-in for the parts of vnstock the app calls, with deterministic synthetic data.
+# install() must run before anything under functions/ is imported.
+import string
+import sys
+import numpy as np
+import pandas as pd
+
+UNIVERSE_SIZE = 100
+INDUSTRIES = ['Banks', 'Real Estate', 'Food & Beverage', 'Construction & Materials', 'Financial Services',
+              'Retail', 'Oil & Gas', 'Utilities', 'Chemicals', 'Technology', 'Travel & Leisure', 'Insurance']
+FIRST_DAY = pd.Timestamp('1995-01-02')
+# HOSE continuous sessions, 09:15-11:30 and 13:00-14:30, as bar open times in minutes
+SESSION_MINUTES = np.concatenate([np.arange(9 * 60 + 15, 11 * 60 + 30), np.arange(13 * 60, 14 * 60 + 30)])
+INTRADAY_MINUTES = {'1': 1, '15': 15, '1H': 60}
+
+
+def _rng(symbol):
+    return np.random.default_rng(sum(ord(c) * 31 ** i for i, c in enumerate(symbol)))
+
+
+def tickers(size):
+    letters = string.ascii_uppercase
+    return [a + b + c for a in letters for b in letters for c in letters][:size]
+
+
+def intraday_bars(symbol, daily, minutes):
+    # Bars that open at the previous close and walk to each day's close
+    # Each day's bars are seeded by the day, so any window returns the same bars for it
+    bar_times = SESSION_MINUTES[::minutes]
+    seed = _rng(symbol).integers(2**32)
+    rngs = [np.random.default_rng([seed, day.toordinal()]) for day in daily['time']]
+    previous = np.concatenate([[daily['open'].iloc[0]], daily['close'].to_numpy()[:-1]])
+    steps = np.array([rng.normal(0, 0.002, len(bar_times)) for rng in rngs]).cumsum(axis=1)
+    steps -= np.linspace(0, 1, len(bar_times)) * steps[:, -1:]
+    path = previous[:, None] + np.linspace(0, 1, len(bar_times)) * (daily['close'].to_numpy() - previous)[:, None]
+    close = np.round(path * np.exp(steps), -1).astype('int64')
+    open_ = np.concatenate([previous[:, None], close[:, :-1]], axis=1).astype('int64')
+    spread = np.round(close * np.array([rng.uniform(0, 0.002, len(bar_times)) for rng in rngs]), -1).astype('int64')
+    return pd.DataFrame({
+        'time': (daily['time'].to_numpy()[:, None] + pd.to_timedelta(bar_times, unit='min').to_numpy()).ravel(),
+        'open': open_.ravel(),
+        'high': (np.maximum(open_, close) + spread).ravel(),
+        'low': (np.minimum(open_, close) - spread).ravel(),
+        'close': close.ravel(),
+        'volume': np.array([rng.integers(100, 100_000, len(bar_times)) for rng in rngs]).ravel(),
+        'ticker': symbol,
+    })
+
+
+def stock_historical_data(symbol, start_date, end_date, resolution='1D', type='stock', beautify=True, decor=False, source='TCBS'):
+    if resolution != '1D':
+        daily = stock_historical_data(symbol, start_date, end_date)
+        return intraday_bars(symbol, daily, INTRADAY_MINUTES[resolution]) if len(daily) else daily
+    rng = _rng(symbol)
+    dates = pd.bdate_range(FIRST_DAY, pd.Timestamp(end_date))
+    close = np.round(20_000 * np.exp(np.cumsum(rng.normal(0.0003, 0.02, len(dates)))), -1)
+    spread = np.round(close * rng.uniform(0, 0.02, len(dates)), -1)
+    df = pd.DataFrame({
+        'time': dates,
+        'open': close - np.round(spread / 2, -1),
+        'high': close + spread,
+        'low': close - spread,
+        'close': close,
+        'volume': rng.integers(1_000, 1_000_000, len(dates)),
+        'ticker': symbol,
+    })
+    df[['open', 'high', 'low', 'close']] = df[['open', 'high', 'low', 'close']].astype('int64')
+    return df[df['time'] >= pd.Timestamp(start_date)].reset_index(drop=True)
+
+
+def stock_screening_insights(params, size=50, id=None, drop_lang='vi'):
+    symbols = tickers(min(size, UNIVERSE_SIZE))
+    rng = np.random.default_rng(len(symbols))
+    n = len(symbols)
+    return pd.DataFrame({
+        'ticker': symbols,
+        'companyName': [f'{symbol} Corporation' for symbol in symbols],
+        'exchangeName.en': rng.choice(['HOSE', 'HNX'], n),
+        'industryName.en': rng.choice(INDUSTRIES, n),
+        'marketCap': np.round(10 ** rng.uniform(2, 5.5, n), 1),
+        'pe': np.round(rng.uniform(-5, 60, n), 2),
+        'pb': np.round(rng.uniform(0.2, 6, n), 2),
+        'roe': np.round(rng.uniform(-10, 40, n), 2),
+        'rsi14': np.round(rng.uniform(10, 90, n), 2),
+        'macdHistogram.en': rng.choice(['MACD Histogram < 0 and increase', 'MACD Histogram > 0 and decrease'], n),
+        'revenueGrowth1Year': np.round(rng.uniform(-30, 80, n), 2),
+    })
+
+
+def general_rating(symbol):
+    return pd.DataFrame({0: {'beta': 1.0}})
+
+
+def _unavailable(*args, **kwargs):
+    raise NotImplementedError('not available offline')
+
+
+financial_ratio = financial_report = company_profile = fr_trade_heatmap = _unavailable
+
+
+def install():
+    sys.modules['vnstock'] = sys.modules[__name__]
@@ -0,0 +1,44 @@
+# Compares binned_kde() against scipy's exact gaussian_kde on the Analyze page's grid.
+# Run from the repository root: python -m benchmarks.kde_accuracy [observations ...]
+import sys
+import time
+import numpy as np
+import scipy.stats as stats
+from benchmarks import fake_vnstock
+
+# functions/ imports vnstock, so the fake keeps this check offline
+fake_vnstock.install()
+
+# Largest error allowed, relative to the peak density
+TOLERANCE = 1e-3
+
+
+def returns(n):
+    # fat-tailed daily returns with volatility clusters
+    rng = np.random.default_rng(n)
+    volatility = 0.02 * np.exp(np.convolve(rng.normal(0, 0.3, n), np.ones(20) / 20, mode='same'))
+    return stats.t.rvs(4, size=n, random_state=rng) * volatility / np.sqrt(2)
+
+
+def main(sizes=(500, 2_000, 10_000, 100_000)):
+    from functions.analytics import KDE_POINTS, binned_kde
+    print(f'{"observations":>14}{"exact s":>10}{"binned s":>10}{"speedup":>10}{"max rel err":>14}')
+    failed = False
+    for n in sizes:
+        values = returns(n)
+        grid = np.linspace(values.min(), values.max(), KDE_POINTS)
+        start = time.perf_counter()
+        exact = stats.gaussian_kde(values).evaluate(grid)
+        exact_time = time.perf_counter() - start
+        start = time.perf_counter()
+        binned = binned_kde(values, grid)
+        binned_time = time.perf_counter() - start
+        error = np.max(np.abs(binned - exact)) / exact.max()
+        failed |= error > TOLERANCE
+        print(f'{n:>14,}{exact_time:>10.4f}{binned_time:>10.4f}{exact_time / binned_time:>10.1f}{error:>14.2e}')
+    if failed:
+        sys.exit(f'binned KDE is off by more than {TOLERANCE:.0e} of the peak density')
+
+
+if __name__ == '__main__':
+    main([int(n) for n in sys.argv[1:]] or (500, 2_000, 10_000, 100_000))
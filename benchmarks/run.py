@@ -0,0 +1,139 @@
+# Offline benchmarks for the simulation and data layers, on synthetic prices from fake_vnstock.
+# Run from the repository root: python -m benchmarks.run [--quick | --full] [--compare old.json]
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from benchmarks import fake_vnstock
+
+# Runs on import too, so spawned test_market workers see the fake and the same store
+fake_vnstock.install()
+os.environ.setdefault('FINETIZE_DATA_DIR', tempfile.mkdtemp(prefix='finetize-bench-'))
+
+LENGTHS = {'1y': 365, '5y': 5 * 365, '20y': 20 * 365}
+STRATEGIES = {'Momentum': (10, 0), 'Mean Reversion': (10, 0), 'Random': (None, 0), 'ARIMA': (None, (1, 0, 1))}
+
+
+def measure(fn, repeats):
+    fn()  # warm up the price store and screener snapshot
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(times), peak
+
+
+def use_universe(size):
+    from functions import screener
+    fake_vnstock.UNIVERSE_SIZE = size
+    screener._snapshot = None
+    if os.path.exists(screener.snapshot_path()):
+        os.remove(screener.snapshot_path())
+
+
+def cases(quick, full):
+    # Each case is measured as soon as it is yielded, so the lambdas see this iteration's values
+    from functions.plots import get_stock_data
+    from functions.select import filter_stock, compare_stocks
+    from functions.simulation import simulate_trading, optimize_choice, test_market, analyze, backtest, kelly_sizing, walk_forward
+    from functions.screener import screener
+    from functions.portfolio import portfolio_backtest
+
+    lengths = {'1y': LENGTHS['1y']} if quick else LENGTHS
+    for label, days in lengths.items():
+        bars = len(get_stock_data('AAA', days))
+        for choice, (period, order) in STRATEGIES.items():
+            if choice == 'ARIMA' and days > LENGTHS['5y'] and not full:
+                continue
+            yield (f'simulate_trading/{choice}/{label}', bars,
+                   lambda: simulate_trading(choice, period, 'AAA', days, 100_000_000, order, 1, plot=False))
+        for choice in ('Momentum', 'Mean Reversion', 'ARIMA'):
+            if choice == 'ARIMA' and days > LENGTHS['1y'] and not full:
+                continue
+            yield f'optimize_choice/{choice}/{label}', bars, lambda: optimize_choice(choice, 'AAA', days, 1)
+            if choice != 'ARIMA':
+                yield f'walk_forward/{choice}/10 folds/{label}', bars, lambda: walk_forward(choice, 'AAA', days)
+        ledger = backtest('Momentum', 1, get_stock_data('AAA', days)['close'], 100_000_000, 0, 0.1)[0]
+        yield f'analyze/{len(ledger)} trades/{label}', bars, lambda: analyze(ledger, 100_000_000, 100)
+        prices = get_stock_data('AAA', days)['close']
+        yield f'kelly_sizing/{label}', bars, lambda: kelly_sizing(prices, seed=0)
+
+    bars = len(get_stock_data('AAA', LENGTHS['1y'], '1m'))
+    for choice in ('Momentum', 'Random'):
+        yield (f'simulate_trading/{choice}/1y 1m', bars,
+               lambda: simulate_trading(choice, 10, 'AAA', LENGTHS['1y'], 100_000_000, 0, 1, plot=False, resolution='1m'))
+
+    for size in [10, 50] if quick else [10, 100, 1700] if full else [10, 100]:
+        use_universe(size)
+        bars = len(get_stock_data('AAA', LENGTHS['1y']))
+        for workers in (1, None):
+            yield (f'test_market/{size} symbols/{"serial" if workers == 1 else "parallel"}', size * bars,
+                   lambda: list(test_market('Momentum', 10, LENGTHS['1y'], workers=workers)))
+        yield (f'portfolio_backtest/{size} symbols', size * bars,
+               lambda: portfolio_backtest('Momentum', 10, days_away=LENGTHS['1y']))
+
+    for size in [100] if quick else [100, 1700]:
+        use_universe(size)
+        df = screener(min_market_cap=100)
+        yield f'filter_stock/{size} symbols', 0, lambda: filter_stock(df, {'pe': 20, 'rsi14': 70}, None)
+        symbols = df['ticker'].head(20).tolist()
+        yield f'compare_stocks/{size} symbols', len(symbols) * 125, lambda: compare_stocks(df, symbols)
+
+
+def version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmarks for the simulation and data layers')
+    parser.add_argument('--quick', action='store_true', help='1y series and small universes only')
+    parser.add_argument('--full', action='store_true', help='add 20y ARIMA and the 1,700 symbol universe')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--out', help='JSON file to write (default benchmarks/results/<version>.json)')
+    parser.add_argument('--compare', help='earlier results JSON to compare against')
+    args = parser.parse_args()
+
+    results = []
+    print(f'{"case":<48}{"seconds":>10}{"sym-days/s":>14}{"peak MB":>10}')
+    for name, symbol_days, fn in cases(args.quick, args.full):
+        seconds, peak = measure(fn, args.repeats)
+        results.append({'case': name, 'seconds': seconds, 'symbol_days': symbol_days,
+                        'symbol_days_per_sec': symbol_days / seconds if symbol_days else None,
+                        'peak_mb': peak / 2**20})
+        rate = f'{symbol_days / seconds:>14,.0f}' if symbol_days else f'{"-":>14}'
+        print(f'{name:<48}{seconds:>10.4f}{rate}{peak / 2**20:>10.1f}')
+
+    report = {'version': version(), 'created': datetime.now().isoformat(timespec='seconds'),
+              'python': platform.python_version(), 'machine': platform.machine(), 'cpus': os.cpu_count(),
+              'results': results}
+    out = args.out or os.path.join(os.path.dirname(__file__), 'results', f'{report["version"]}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'\nWrote {out}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = {r['case']: r for r in json.load(f)['results']}
+        print(f'\n{"case":<48}{"before":>10}{"after":>10}{"speedup":>10}')
+        for result in results:
+            before = previous.get(result['case'])
+            if before:
+                print(f'{result["case"]:<48}{before["seconds"]:>10.4f}{result["seconds"]:>10.4f}{before["seconds"] / result["seconds"]:>9.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+import glob
+import os
+import threading
+import numpy as np
+import pandas as pd
+import scipy.stats as stats
+from scipy.signal import fftconvolve
+from cachetools import LRUCache
+from statsmodels.graphics.tsaplots import acf, pacf
+from functions.plots import get_stock_data
+from functions.store import DATA_DIR, write_atomic
+
+# Everything the Analyze page derives from one price series, computed on first use and
+# kept per (symbol, window, resolution, last bar). Computed values are also pickled
+# under DATA_DIR, so a new session or a restarted server picks them up without
+# redoing the work.
+KDE_POINTS = 1000
+KDE_EXACT_LIMIT = 2000  # longer histories use binned_kde() and a pre-binned histogram
+HISTOGRAM_BINS = 50
+MARKET_SYMBOL = 'VNINDEX'
+_cache = LRUCache(maxsize=256)
+_lock = threading.Lock()
+
+
+def analytics_path(symbol, days_away, resolution, last_bar):
+    return os.path.join(DATA_DIR, 'analytics', f'{symbol}-{days_away}-{resolution}-{last_bar:%Y%m%d%H%M}.pkl')
+
+
+def linear_bins(values, grid):
+    # Each value split between its two neighbouring grid points in proportion to distance
+    step = grid[1] - grid[0]
+    position = np.clip((values - grid[0]) / step, 0, len(grid) - 1)
+    left = np.minimum(position.astype(int), len(grid) - 2)
+    right_weight = position - left
+    weights = np.bincount(left, 1 - right_weight, len(grid))
+    weights += np.bincount(left + 1, right_weight, len(grid))
+    return weights
+
+
+def binned_kde(values, grid):
+    # gaussian_kde (Scott's bandwidth) on an evenly spaced grid, as the binned data
+    # convolved with the kernel. Costs O(n + points log points) instead of O(n * points).
+    values = np.asarray(values, dtype=float)
+    bandwidth = values.std(ddof=1) * len(values) ** -0.2
+    step = grid[1] - grid[0]
+    offsets = np.arange(-(len(grid) - 1), len(grid)) * step
+    kernel = stats.norm.pdf(offsets, scale=bandwidth)
+    return fftconvolve(linear_bins(values, grid), kernel, mode='valid') / len(values)
+
+
+class SymbolAnalytics:
+    def __init__(self, symbol, days_away, df, resolution='1D'):
+        self.symbol = symbol
+        self.days_away = days_away
+        self.resolution = resolution
+        self.df = df
+        self.key = (symbol, days_away, resolution, df.index[-1])
+        self.path = analytics_path(*self.key)
+        self.values = pd.read_pickle(self.path) if os.path.exists(self.path) else {}
+        self._lock = threading.RLock()
+
+    def _memo(self, name, compute):
+        with self._lock:
+            if name not in self.values:
+                self.values[name] = compute()
+                self._save()
+            return self.values[name]
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if not os.path.exists(self.path):
+            # values for older bars of the same symbol and window are no longer reachable
+            for stale in glob.glob(os.path.join(os.path.dirname(self.path), f'{self.symbol}-{self.days_away}-{self.resolution}-*.pkl')):
+                os.remove(stale)
+        write_atomic(self.path, lambda temp: pd.to_pickle(self.values, temp))
+
+    def returns(self):
+        return self._memo('returns', lambda: self.df['close'].pct_change().dropna())
+
+    def binned(self):
+        # Returns binned onto the KDE grid, None while the exact KDE is cheap enough
+        def compute():
+            returns = self.returns()
+            if len(returns) <= KDE_EXACT_LIMIT:
+                return None
+            return linear_bins(returns.to_numpy(), np.linspace(returns.min(), returns.max(), KDE_POINTS))
+        return self._memo('binned', compute)
+
+    def kde(self):
+        # (x, density) on KDE_POINTS points spanning the observed returns
+        def compute():
+            returns = self.returns()
+            x_vals = np.linspace(returns.min(), returns.max(), KDE_POINTS)
+            if self.binned() is None:
+                return x_vals, stats.gaussian_kde(returns).evaluate(x_vals)
+            return x_vals, binned_kde(returns.to_numpy(), x_vals)
+        return self._memo('kde', compute)
+
+    def histogram(self):
+        # (bin centres, bin width, density) summed from the binned grid, so the histogram
+        # trace stays HISTOGRAM_BINS bars long; None when the raw returns are plotted instead
+        def compute():
+            binned = self.binned()
+            if binned is None:
+                return None
+            x_vals = self.kde()[0]
+            edges = np.linspace(0, len(binned), HISTOGRAM_BINS + 1).round().astype(int)
+            counts = np.add.reduceat(binned, edges[:-1])
+            low, high = x_vals[0], x_vals[-1]
+            width = (high - low) / HISTOGRAM_BINS
+            centres = low + (np.arange(HISTOGRAM_BINS) + 0.5) * width
+            return centres, width, counts / (counts.sum() * width)
+        return self._memo('histogram', compute)
+
+    def correlogram(self, partial=False):
+        # (coefficients, lower band, upper band), the bands centred on zero as plotted
+        def compute():
+            corr, confint = (pacf if partial else acf)(self.returns(), alpha=0.05)
+            return corr, confint[:, 0] - corr, confint[:, 1] - corr
+        return self._memo('pacf' if partial else 'acf', compute)
+
+    def summary(self):
+        def compute():
+            returns = self.returns()
+            return pd.DataFrame({'Statistic': ['Mean', 'Median', 'Min', 'Max'],
+                                 'Return': [returns.mean(), returns.median(), returns.min(), returns.max()]})
+        return self._memo('summary', compute)
+
+    def market_returns(self):
+        # (symbol returns, market returns) on the dates both traded
+        def compute():
+            market = get_stock_data(MARKET_SYMBOL, self.days_away, self.resolution)
+            market = market['close'].pct_change().dropna().rename('market')
+            aligned = pd.concat([self.returns().rename('symbol'), market], axis=1, join='inner')
+            return aligned['symbol'], aligned['market']
+        return self._memo('market_returns', compute)
+
+
+def symbol_analytics(symbol, days_away, resolution='1D'):
+    df = get_stock_data(symbol, days_away, resolution)
+    if len(df) == 0:
+        raise ValueError(f'No price data for {symbol}')
+    key = (symbol, days_away, resolution, df.index[-1])
+    with _lock:
+        analytics = _cache.get(key)
+        if analytics is None:
+            analytics = _cache[key] = SymbolAnalytics(symbol, days_away, df, resolution)
+    return analytics
@@ -0,0 +1,248 @@
+# Headless runs of market tests, parameter grids and single-symbol simulations from a
+# config file, so long jobs don't need a browser session. Run from the repository root:
+#   python -m functions.batch config.json [--out DIR] [--workers N] [--force]
+#
+# The config is JSON (or TOML) with a list of jobs, for example
+#   {"jobs": [
+#     {"type": "market", "choice": "Momentum", "period": 10, "days_away": 365},
+#     {"type": "grid", "choice": "Mean Reversion", "symbols": ["FPT", "VNM"], "days_away": 1825,
+#      "position_sizings": [1, 0.5], "costs": ["Default", "HOSE"]},
+#     {"type": "simulate", "choice": "ARIMA", "order": [1, 0, 1], "symbols": ["FPT"], "days_away": 365}
+#   ]}
+#
+# Market jobs go into the result store (functions/results.py), where the Backtest page
+# finds them, and are copied to DIR/<name>.parquet. Grid and simulate jobs write one
+# Parquet file per symbol under DIR/<name>/ and a combined file next to it. Every symbol
+# is checkpointed as it finishes, so running the same config again after an interruption
+# only runs the symbols that are missing (or failed). Default names end in a hash of the
+# job's settings, and a checkpoint folder records the hash it was made with, so an edited
+# job never resumes from another job's checkpoints. DIR/manifest.json records when each
+# job last finished, its hash and what it wrote.
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import as_completed
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+import pandas as pd
+from functions.plots import get_stock_data
+from functions.store import write_atomic
+from functions.simulation import backtest, sweep_choice, market_tickers, process_pool, _process_pools, ARIMA_ORDERS
+from functions.results import result_key, stale_tickers, update_results, load_results
+
+JOB_TYPES = ('market', 'grid', 'simulate')
+# Market jobs go through the result store, which tests daily bars at the default costs
+MARKET_KEYS = ('type', 'name', 'choice', 'period', 'order', 'days_away', 'position_sizing', 'symbols', 'timeout')
+
+
+def load_config(path):
+    if path.endswith('.toml'):
+        import tomllib
+        with open(path, 'rb') as f:
+            return tomllib.load(f)
+    with open(path) as f:
+        return json.load(f)
+
+
+def job_order(job):
+    order = job.get('order', 0)
+    return tuple(order) if isinstance(order, list) else order
+
+
+def job_settings(job):
+    # Everything a symbol's result depends on, defaults filled in. The symbols (each is
+    # checkpointed on its own), the timeout and the name are left out.
+    if job['type'] == 'market':
+        settings = {'period': None, 'order': 0, 'position_sizing': 1}
+    elif job['type'] == 'grid':
+        settings = {'resolution': '1D', 'periods': list(range(1, 31)), 'position_sizings': [1], 'costs': ['Default'],
+                    'orders': [list(order) for order in ARIMA_ORDERS]}
+    else:
+        settings = {'resolution': '1D', 'period': None, 'order': 0, 'position_sizing': 1, 'amt': 100_000_000,
+                    'costs': 'Default'}
+    settings.update({key: value for key, value in job.items() if key not in ('name', 'symbols', 'timeout')})
+    return settings
+
+
+def job_hash(job):
+    settings = json.dumps(job_settings(job), sort_keys=True, default=str)
+    return hashlib.sha1(settings.encode()).hexdigest()[:10]
+
+
+def job_name(job):
+    # grids run every period (order), so they are named after none
+    param = job.get('order', job.get('period', 'all'))
+    if isinstance(param, (tuple, list)):
+        param = '.'.join(map(str, param))
+    return job.get('name') or f'{job["type"]}-{job["choice"].replace(" ", "")}-{param}-{job["days_away"]}-{job_hash(job)}'
+
+
+def checkpoint_hash(out, job):
+    # The hash the job's checkpoint folder was made with, None if it has none yet
+    path = os.path.join(out, job_name(job), 'job.json')
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)['hash']
+
+
+def write_parquet(df, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_atomic(path, df.to_parquet)
+
+
+def write_json(data, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    def write(temp):
+        with open(temp, 'w') as f:
+            json.dump(data, f, indent=2, default=str)
+    write_atomic(path, write)
+
+
+def grid_symbol(job, symbol):
+    # Runs in a worker process: the sweep_choice() surface of one symbol
+    job = job_settings(job)
+    surface = sweep_choice(job['choice'], symbol, job['days_away'], periods=job['periods'],
+                           position_sizings=job['position_sizings'], costs=job['costs'],
+                           orders=[tuple(order) for order in job['orders']], resolution=job['resolution'])
+    surface = surface.reset_index()
+    if job['choice'] == 'ARIMA':
+        surface['order'] = surface['order'].astype(str)
+    return surface
+
+
+def simulate_symbol(job, symbol):
+    # Runs in a worker process: (trades frame, analyze() stats) of one symbol
+    job = job_settings(job)
+    prices = get_stock_data(symbol, job['days_away'], job['resolution'])
+    if len(prices) == 0:
+        raise ValueError(f'No price data for {symbol}')
+    ledger, _, _, stats = backtest(job['choice'], job['period'], prices['close'], job['amt'],
+                                   job_order(job), job['position_sizing'], costs=job['costs'])
+    return ledger.to_frame(), stats
+
+
+def run_market(job, out, workers, force=False):
+    key = result_key(job['choice'], job.get('period'), job['days_away'], job.get('position_sizing', 1), job_order(job))
+    if force:
+        tickers = job.get('symbols') or market_tickers()
+    else:
+        tickers = stale_tickers(key, job.get('symbols'))
+    print(f'{len(tickers)} symbols to test')
+    for done, (ticker, _, error) in enumerate(update_results(key, tickers, workers, job.get('timeout')), 1):
+        if error is not None:
+            print(f'{ticker}: {error}')
+        if done % 50 == 0 or done == len(tickers):
+            print(f'Tested {done}/{len(tickers)} symbols')
+    path = os.path.join(out, f'{job_name(job)}.parquet')
+    write_parquet(load_results(key), path)
+    return [path]
+
+
+def run_symbols(job, out, workers):
+    # One checkpoint file per symbol; symbols that already have one are skipped
+    folder = os.path.join(out, job_name(job))
+    write_json({'hash': job_hash(job), 'job': job_settings(job)}, os.path.join(folder, 'job.json'))
+    fn = grid_symbol if job['type'] == 'grid' else simulate_symbol
+    todo = [symbol for symbol in job['symbols'] if not os.path.exists(os.path.join(folder, f'{symbol}.parquet'))]
+    print(f'{len(todo)} of {len(job["symbols"])} symbols to run')
+
+    def save(symbol, result):
+        if job['type'] == 'grid':
+            write_parquet(result, os.path.join(folder, f'{symbol}.parquet'))
+        else:
+            # stats first, so a symbol with a trades file always has its stats
+            write_json(result[1], os.path.join(folder, f'{symbol}.json'))
+            write_parquet(result[0], os.path.join(folder, f'{symbol}.parquet'))
+
+    if workers == 1:
+        for symbol in todo:
+            try:
+                save(symbol, fn(job, symbol))
+            except Exception as e:
+                print(f'{symbol}: {type(e).__name__}: {e}')
+    else:
+        workers = workers or os.cpu_count() or 1
+        try:
+            futures = {process_pool(workers).submit(fn, job, symbol): symbol for symbol in todo}
+            for future in as_completed(futures):
+                try:
+                    save(futures[future], future.result())
+                except BrokenProcessPool:
+                    raise
+                except Exception as e:
+                    print(f'{futures[future]}: {type(e).__name__}: {e}')
+        except BrokenProcessPool:
+            _process_pools.pop(workers, None)
+            raise
+
+    done = [symbol for symbol in job['symbols'] if os.path.exists(os.path.join(folder, f'{symbol}.parquet'))]
+    if job['type'] == 'grid':
+        path = os.path.join(out, f'{job_name(job)}.parquet')
+        frames = {symbol: pd.read_parquet(os.path.join(folder, f'{symbol}.parquet')) for symbol in done}
+        if frames:
+            write_parquet(pd.concat(frames, names=['symbol', 'row']).reset_index(level='row', drop=True), path)
+    else:
+        path = os.path.join(out, f'{job_name(job)}.json')
+        stats = {}
+        for symbol in done:
+            with open(os.path.join(folder, f'{symbol}.json')) as f:
+                stats[symbol] = json.load(f)
+        write_json(stats, path)
+    return [path, folder]
+
+
+def run_batch(config, out, workers=None, force=False):
+    jobs = config['jobs']
+    for job in jobs:
+        if job.get('type') not in JOB_TYPES:
+            raise ValueError(f'Unknown job type {job.get("type")}, expected one of {", ".join(JOB_TYPES)}')
+        if job['type'] != 'market' and not job.get('symbols'):
+            raise ValueError(f'{job_name(job)} needs a list of symbols')
+        unsupported = [key for key in job if job['type'] == 'market' and key not in MARKET_KEYS]
+        if unsupported:
+            raise ValueError(f'{job_name(job)}: market jobs run daily bars at the default costs and amount, '
+                             f'so {", ".join(unsupported)} cannot be set; use a grid or simulate job')
+    names = {}
+    for job in jobs:
+        name = job_name(job)
+        if names.setdefault(name, job_hash(job)) != job_hash(job):
+            raise ValueError(f'Two jobs are named {name} but have different settings')
+        if job['type'] != 'market' and not force and checkpoint_hash(out, job) not in (None, job_hash(job)):
+            raise ValueError(f'{name} has checkpoints from a job with different settings; '
+                             'rerun with --force or give the job a new name')
+    manifest_path = os.path.join(out, 'manifest.json')
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    for job in jobs:
+        name = job_name(job)
+        print(f'Running {name}')
+        if job['type'] == 'market':
+            files = run_market(job, out, workers, force)
+        else:
+            if force:
+                folder = os.path.join(out, name)
+                for file in os.listdir(folder) if os.path.isdir(folder) else []:
+                    os.remove(os.path.join(folder, file))
+            files = run_symbols(job, out, workers)
+        manifest[name] = {'job': job, 'hash': job_hash(job), 'finished': datetime.now().isoformat(timespec='seconds'),
+                          'files': files}
+        write_json(manifest, manifest_path)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run market tests, parameter grids and simulations from a config file')
+    parser.add_argument('config', help='JSON or TOML file with a "jobs" list')
+    parser.add_argument('--out', default='batch-results', help='directory for results and checkpoints')
+    parser.add_argument('--workers', type=int, help='worker processes (default: one per CPU, 1 runs in this process)')
+    parser.add_argument('--force', action='store_true', help='rerun finished jobs and symbols')
+    args = parser.parse_args()
+    run_batch(load_config(args.config), args.out, args.workers, args.force)
+
+
+if __name__ == '__main__':
+    main()
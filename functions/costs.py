@@ -0,0 +1,109 @@
+import numpy as np
+
+# What a trade costs and when its shares or cash can be used again. The engines take
+# one CostModel and turn it into per-bar arrays (settlement unlocks and which bars can
+# fill a buy or a sell) once per run, so sweeping several models only reruns the trade
+# loop. Plain floats are still accepted wherever a model is, as a flat sell cost.
+BAND_TOLERANCE = 0.005  # closes this close to the band are taken as limit moves
+
+
+class CostModel:
+    __slots__ = ('name', 'fee_tiers', 'sell_tax', 'fee_on_buy', 'lot_size', 'price_band', 'settlement_days')
+
+    def __init__(self, name='Default', fee_tiers=((0, 0.0025),), sell_tax=0.001, fee_on_buy=False,
+                 lot_size=1, price_band=None, settlement_days=2):
+        # fee_tiers: ((order value from, fee rate), ...) in ascending order of value.
+        # price_band: the largest daily move as a fraction, None for no limit.
+        self.name = name
+        self.fee_tiers = tuple((float(value), float(rate)) for value, rate in fee_tiers)
+        self.sell_tax = sell_tax
+        self.fee_on_buy = fee_on_buy
+        self.lot_size = lot_size
+        self.price_band = price_band
+        self.settlement_days = settlement_days
+
+    def __repr__(self):
+        return f'CostModel({self.name!r})'
+
+    def fee_rate(self, value):
+        # The broker fee for orders of value (scalar or array), from the tier it reaches
+        thresholds = np.array([tier[0] for tier in self.fee_tiers])
+        rates = np.array([tier[1] for tier in self.fee_tiers])
+        tier = np.maximum(np.searchsorted(thresholds, value, side='right') - 1, 0)
+        return rates[tier] if np.ndim(value) else float(rates[tier])
+
+    def buy_rate(self, value):
+        return self.fee_rate(value) if self.fee_on_buy else 0.0
+
+    def sell_rate(self, value):
+        return self.fee_rate(value) + self.sell_tax
+
+    def buy_quantity(self, cash, price):
+        # Whole lots of shares that cash buys at price, fee included; the fee tier is
+        # taken from the cash committed
+        cost = price * (1 + self.buy_rate(cash))
+        if not cost * self.lot_size < cash:
+            return 0
+        return int(cash / cost) // self.lot_size * self.lot_size
+
+    def sessions(self, dates):
+        # The trading session (calendar day) index of each bar, from 0
+        days = np.asarray(dates, dtype='datetime64[ns]').astype('datetime64[D]')
+        return np.concatenate([[0], np.cumsum(days[1:] != days[:-1])])
+
+    def settlement_unlock(self, dates):
+        # unlock[j]: the first bar that may trade after a trade at bar j, i.e. the first
+        # bar settlement_days + 1 sessions later. That is j + 3 for daily bars at T+2,
+        # and the open of the third session after for intraday bars.
+        session = self.sessions(dates)
+        return np.searchsorted(session, session + self.settlement_days + 1)
+
+    def fillable(self, prices, dates):
+        # (can_buy, can_sell) per bar, or per bar and symbol for a 2-D panel: nothing is
+        # bought at the ceiling or sold at the floor of the price band. The band is set
+        # from the last close of the previous session, so on intraday bars it holds for
+        # the whole day. Bars of the first session have no reference price and can fill both.
+        prices = np.asarray(prices, dtype=float)
+        can_buy = np.ones(prices.shape, dtype=bool)
+        can_sell = np.ones(prices.shape, dtype=bool)
+        if self.price_band is not None and len(prices) > 1:
+            session = self.sessions(dates)
+            reference = np.searchsorted(session, session) - 1
+            later = reference >= 0
+            move = prices[later] / prices[reference[later]] - 1
+            can_buy[later] = move < self.price_band - BAND_TOLERANCE
+            can_sell[later] = move > -self.price_band + BAND_TOLERANCE
+        return can_buy, can_sell
+
+    def assumptions(self):
+        # The model in words, for the Simulate page
+        tiers = [f'`{rate:.2%}`' + (f' from `{value:,.0f}`' if value else '') for value, rate in self.fee_tiers]
+        lines = [f'Taxes account for `{self.sell_tax:.2%}` when selling',
+                 f'Transaction fees account for {", ".join(tiers)} when {"buying and selling" if self.fee_on_buy else "selling"}',
+                 f'Share will return after `{self.settlement_days}` trading days when buying',
+                 f'Money will return after `{self.settlement_days}` trading days when selling']
+        if self.lot_size > 1:
+            lines.append(f'Shares are bought in lots of `{self.lot_size}`')
+        if self.price_band is not None:
+            lines.append(f'Prices move at most `{self.price_band:.0%}` a day; no buys at the ceiling or sells at the floor')
+        return lines
+
+
+DEFAULT_COSTS = CostModel()
+# Lots, fees on both sides, a typical broker's value tiers and the exchange's daily band
+COST_MODELS = {
+    'Default': DEFAULT_COSTS,
+    'HOSE': CostModel('HOSE', fee_tiers=((0, 0.0025), (100_000_000, 0.002), (1_000_000_000, 0.0015)),
+                      fee_on_buy=True, lot_size=100, price_band=0.07),
+    'HNX': CostModel('HNX', fee_tiers=((0, 0.0025), (100_000_000, 0.002), (1_000_000_000, 0.0015)),
+                     fee_on_buy=True, lot_size=100, price_band=0.10),
+}
+
+
+def cost_model(costs):
+    # A CostModel from a model, a COST_MODELS name or a flat sell cost
+    if isinstance(costs, CostModel):
+        return costs
+    if isinstance(costs, str):
+        return COST_MODELS[costs]
+    return CostModel(f'{costs:.2%} on sells', fee_tiers=((0, costs),), sell_tax=0)
@@ -1,15 +1,54 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from vnstock import financial_report
 import pandas as pd
+from cachetools import LRUCache
+from functions.store import DATA_DIR, write_atomic
 
+# Financial statements are persisted under DATA_DIR and only fetched again once they
+# are older than STATEMENT_TTL. Evaluations are memoized per (symbol, frequency, latest
+# period of each statement), so they are recomputed only when a new period is published.
+STATEMENT_TTL = timedelta(days=1)
+REPORT_TYPES = ('IncomeStatement', 'BalanceSheet', 'CashFlow')
+_evaluations = LRUCache(maxsize=512)
+_lock = threading.Lock()
 
-def symbol_eval(symbol, frequency):
-    income_statement = financial_report(symbol, report_type='IncomeStatement', frequency=frequency.capitalize())
-    income_statement = income_statement.set_index(income_statement.columns[0])
-    balance_sheet = financial_report(symbol, report_type='BalanceSheet', frequency=frequency.capitalize())
-    balance_sheet = balance_sheet.set_index(balance_sheet.columns[0])
-    cash_flow = financial_report(symbol, report_type='CashFlow', frequency=frequency.capitalize())
-    cash_flow = cash_flow.set_index(cash_flow.columns[0])
 
+def statement_path(symbol, report_type, frequency):
+    return os.path.join(DATA_DIR, 'statements', f'{symbol.upper()}-{report_type}-{frequency}.pkl')
+
+
+def load_statement(symbol, report_type, frequency, max_age=STATEMENT_TTL):
+    # One report with its row labels as the index and one column per period
+    path = statement_path(symbol, report_type, frequency)
+    stored = pd.read_pickle(path) if os.path.exists(path) else None
+    if stored is not None and datetime.today() - stored[0] <= max_age:
+        return stored[1]
+    try:
+        statement = financial_report(symbol, report_type=report_type, frequency=frequency)
+        statement = statement.set_index(statement.columns[0])
+    except Exception:
+        if stored is None:
+            raise
+        print(f"Error refreshing the {report_type} of {symbol}, serving the stored one.")
+        return stored[1]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_atomic(path, lambda temp: pd.to_pickle((datetime.today(), statement), temp))
+    return statement
+
+
+def load_statements(symbol, frequency, pool=None):
+    # The three reports of symbol, fetched concurrently
+    if pool is None:
+        with ThreadPoolExecutor(len(REPORT_TYPES)) as pool:
+            return load_statements(symbol, frequency, pool)
+    futures = [pool.submit(load_statement, symbol, report_type, frequency) for report_type in REPORT_TYPES]
+    return [future.result() for future in futures]
+
+
+def evaluate_statements(income_statement, balance_sheet, cash_flow, frequency):
     financial = {
         'Sales': income_statement.loc['Doanh số thuần'],
         'Gross Profit': income_statement.loc['Lãi gộp'],
@@ -45,22 +84,45 @@ def symbol_eval(symbol, frequency):
         'Equity': balance_sheet.loc['VỐN CHỦ SỞ HỮU'],
         'Total Capital': balance_sheet.loc['Vay dài hạn'] + balance_sheet.loc['Vay ngắn hạn'] + balance_sheet.loc['VỐN CHỦ SỞ HỮU'],
     }
-    total_capital = balance['Total Capital']
-    if frequency.capitalize() == 'Yearly':
-        avg = [None]
-        for i in range(len(total_capital) - 1):
-            average = (total_capital.iloc[i] + total_capital.iloc[i + 1]) / 2
-            avg.append(average)
-    else:
-        avg = [None, None, None]
-        for i in range(len(total_capital) - 4):
-            average = (total_capital.iloc[i] + total_capital.iloc[i + 1] + total_capital.iloc[i + 3] + total_capital.iloc[i + 4]) / 4
-            avg.append(average)
-
-    balance['Average Total Capital (2_yrs)'] = avg
-
-# Create the DataFrame
+    # over the last two year-ends: this year and the last, or the last five quarter-ends
+    window = 2 if frequency == 'Yearly' else 5
+    balance['Average Total Capital (2_yrs)'] = balance['Total Capital'].rolling(window).mean()
+
     financial_df = pd.DataFrame(financial).T
     balance_df = pd.DataFrame(balance).T
 
     return financial_df, balance_df
+
+
+def symbol_eval(symbol, frequency, pool=None):
+    frequency = frequency.capitalize()
+    statements = load_statements(symbol, frequency, pool)
+    key = (symbol.upper(), frequency) + tuple(statement.columns[-1] for statement in statements)
+    with _lock:
+        result = _evaluations.get(key)
+    if result is None:
+        result = evaluate_statements(*statements, frequency)
+        with _lock:
+            _evaluations[key] = result
+    return result
+
+
+def symbol_eval_many(symbols, frequency, workers=8):
+    # Every symbol's statements fetched on one pool, returned as two frames indexed
+    # by (symbol, metric). Symbols whose statements can't be fetched are left out.
+    def evaluate(symbol):
+        try:
+            return symbol_eval(symbol, frequency, pool)
+        except Exception as e:
+            print(f"Error evaluating {symbol}: {e}")
+
+    # statement fetches go on their own pool, so a symbol waiting on its three never
+    # holds up the workers that fetch them
+    with ThreadPoolExecutor(workers) as pool, ThreadPoolExecutor(workers) as symbol_pool:
+        results = dict(zip(symbols, symbol_pool.map(evaluate, symbols)))
+    results = {symbol: result for symbol, result in results.items() if result is not None}
+    if not results:
+        return pd.DataFrame(), pd.DataFrame()
+    financial_df = pd.concat({symbol: result[0] for symbol, result in results.items()}, names=['symbol', 'metric'])
+    balance_df = pd.concat({symbol: result[1] for symbol, result in results.items()}, names=['symbol', 'metric'])
+    return financial_df, balance_df
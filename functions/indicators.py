@@ -0,0 +1,93 @@
+import json
+import os
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from functions.plots import get_stock_panel, panel_field
+from functions.screener import screener
+from functions.store import DATA_DIR, write_atomic
+
+# Technical indicators for the whole universe, computed in one pass over a
+# date x symbol close panel and kept as a columnar table (one row per ticker).
+INDICATOR_TTL = timedelta(hours=12)
+INDICATOR_DAYS = 420  # enough bars for SMA200 and 12-month momentum
+INDICATOR_COLUMNS = ['rsi14', 'macd', 'macdSignal', 'macdHistogram', 'macdHistogramDelta',
+                     'closeToSma20', 'closeToSma50', 'closeToSma200', 'volatility20',
+                     'momentum21', 'momentum63', 'momentum126', 'momentum252']
+
+
+def indicators_path():
+    return os.path.join(DATA_DIR, 'indicators.parquet')
+
+
+def compute_indicators(close):
+    # close: date x symbol frame; returns one row of the latest values per symbol
+    if close.empty:
+        return pd.DataFrame(columns=['close', *INDICATOR_COLUMNS], index=pd.Index([], name='ticker'), dtype=float)
+    close = close.sort_index().ffill()
+    delta = close.diff()
+    gain = delta.clip(lower=0).ewm(alpha=1/14, adjust=False, min_periods=14).mean()
+    loss = (-delta.clip(upper=0)).ewm(alpha=1/14, adjust=False, min_periods=14).mean()
+    rsi = 100 - 100 / (1 + gain / loss)
+    macd = close.ewm(span=12, adjust=False).mean() - close.ewm(span=26, adjust=False).mean()
+    signal = macd.ewm(span=9, adjust=False).mean()
+    histogram = macd - signal
+    returns = close.pct_change(fill_method=None)
+
+    last = close.iloc[-1]
+    table = pd.DataFrame({
+        'close': last,
+        'rsi14': rsi.iloc[-1],
+        'macd': macd.iloc[-1],
+        'macdSignal': signal.iloc[-1],
+        'macdHistogram': histogram.iloc[-1],
+        'macdHistogramDelta': histogram.iloc[-1] - histogram.iloc[-2] if len(close) > 1 else np.nan,
+        'closeToSma20': last / close.rolling(20).mean().iloc[-1] - 1,
+        'closeToSma50': last / close.rolling(50).mean().iloc[-1] - 1,
+        'closeToSma200': last / close.rolling(200).mean().iloc[-1] - 1,
+        'volatility20': returns.rolling(20).std().iloc[-1] * np.sqrt(252),
+    })
+    for days in (21, 63, 126, 252):
+        table[f'momentum{days}'] = last / close.shift(days).iloc[-1] - 1 if len(close) > days else np.nan
+    table.index.name = 'ticker'
+    return table
+
+
+def build_indicators(symbols=None, days_away=INDICATOR_DAYS):
+    if symbols is None:
+        symbols = screener()['ticker'].tolist()
+    close = panel_field(get_stock_panel(symbols, days_away, fields=('close',)), 'close')
+    table = compute_indicators(close)
+    as_of = close.index[-1] if len(close) else pd.Timestamp(datetime.today()).normalize()
+    path = indicators_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    arrow = pa.Table.from_pandas(table)
+    meta = {'as_of': as_of.isoformat(), 'built_at': datetime.today().isoformat()}
+    arrow = arrow.replace_schema_metadata({**(arrow.schema.metadata or {}), b'finetize': json.dumps(meta)})
+    write_atomic(path, lambda temp: pq.write_table(arrow, temp))
+    return table
+
+
+def load_indicators(max_age=INDICATOR_TTL):
+    # The stored table, rebuilt first if it is missing or older than max_age
+    path = indicators_path()
+    if os.path.exists(path):
+        arrow = pq.read_table(path)
+        meta = json.loads(arrow.schema.metadata[b'finetize'])
+        if datetime.today() - datetime.fromisoformat(meta['built_at']) <= max_age:
+            return arrow.to_pandas()
+    return build_indicators()
+
+
+def query_indicators(table, ranges):
+    # ranges: {column: (low, high)}, either bound may be None; both are inclusive
+    mask = np.ones(len(table), dtype=bool)
+    for column, (low, high) in ranges.items():
+        values = table[column].to_numpy()
+        if low is not None:
+            mask &= values >= low
+        if high is not None:
+            mask &= values <= high
+    return table[mask]
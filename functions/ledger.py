@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+
+BUY = 1
+SELL = -1
+LEDGER_DTYPE = np.dtype([
+    ('side', 'i1'),     # BUY or SELL
+    ('date', 'M8[ns]'),
+    ('price', 'f8'),
+    ('qty', 'i8'),
+    ('ret', 'f8'),      # realized return of a sell against the average buy price, nan for buys
+    ('cash', 'f8'),     # cash left after the trade
+])
+
+
+class TradeLedger:
+    # The trades of one simulation as columns of a NumPy structured array
+    __slots__ = ('trades',)
+
+    def __init__(self, trades=None):
+        self.trades = np.zeros(0, dtype=LEDGER_DTYPE) if trades is None else np.asarray(trades, dtype=LEDGER_DTYPE)
+
+    @classmethod
+    def from_rows(cls, rows):
+        # rows of (side, date, price, qty, ret, cash)
+        trades = np.zeros(len(rows), dtype=LEDGER_DTYPE)
+        if rows:
+            side, date, price, qty, ret, cash = zip(*rows)
+            trades['side'], trades['price'], trades['qty'], trades['ret'], trades['cash'] = side, price, qty, ret, cash
+            trades['date'] = np.asarray(date, dtype='M8[ns]')
+        return cls(trades)
+
+    @classmethod
+    def from_events(cls, events_list):
+        # the old ('b', date, price, qty) / ('s', date, price, ret, qty, cash) tuples
+        return cls.from_rows([(BUY, e[1], e[2], e[3], np.nan, np.nan) if e[0] == 'b' else (SELL, e[1], e[2], e[4], e[3], e[5])
+                              for e in events_list])
+
+    def events(self):
+        return [('b', pd.Timestamp(t['date']), t['price'], int(t['qty'])) if t['side'] == BUY
+                else ('s', pd.Timestamp(t['date']), t['price'], t['ret'], int(t['qty']), t['cash'])
+                for t in self.trades]
+
+    def __len__(self):
+        return len(self.trades)
+
+    side = property(lambda self: self.trades['side'])
+    date = property(lambda self: self.trades['date'])
+    price = property(lambda self: self.trades['price'])
+    qty = property(lambda self: self.trades['qty'])
+    ret = property(lambda self: self.trades['ret'])
+    cash = property(lambda self: self.trades['cash'])
+
+    def shares_held(self):
+        return np.cumsum(np.where(self.side == BUY, self.qty, -self.qty))
+
+    def trading_volume(self):
+        return self.price.sum()
+
+    def book_values(self, book_size):
+        # Book size after each trade, marked at the trade price. Buys add their price to
+        # the running book the same way analyze() always has.
+        book = np.cumsum(np.concatenate([[book_size], np.where(self.side == BUY, self.price, 0)]))[1:]
+        return self.shares_held() * self.price + book
+
+    def pnl(self, book_size):
+        book = self.book_values(book_size)
+        previous = np.concatenate([[book_size], book[:-1]])
+        return (book - previous) / previous
+
+    def sharpe(self, book_size):
+        pnl = self.pnl(book_size)
+        std_dev_pnl = np.std(pnl)
+        return np.mean(pnl) / std_dev_pnl if std_dev_pnl != 0 else np.nan
+
+    def turnover(self, book_size):
+        final_book_size = max(self.book_values(book_size)[-1], 0)
+        return self.trading_volume() / final_book_size * 100 if final_book_size != 0 else 0
+
+    def to_frame(self, symbol=None):
+        frame = pd.DataFrame(self.trades)
+        if symbol is not None:
+            frame.insert(0, 'symbol', symbol)
+        return frame
+
+    @classmethod
+    def from_frame(cls, frame):
+        trades = np.zeros(len(frame), dtype=LEDGER_DTYPE)
+        for name in LEDGER_DTYPE.names:
+            trades[name] = frame[name].to_numpy()
+        return cls(trades)
+
+    def save(self, path):
+        np.save(path, self.trades)
+
+    @classmethod
+    def load(cls, path):
+        return cls(np.load(path))
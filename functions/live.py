@@ -0,0 +1,209 @@
+import os
+import random
+from collections import deque
+from itertools import islice
+import numpy as np
+import pandas as pd
+from statsmodels.tsa.arima.model import ARIMA
+from functions.plots import get_stock_panel, panel_field
+from functions.ledger import BUY, SELL, TradeLedger
+from functions.store import DATA_DIR, write_atomic
+from functions.simulation import ARIMA_REFIT_EVERY
+from functions.costs import DEFAULT_COSTS, BAND_TOLERANCE, cost_model
+
+# Strategies fed one bar at a time for paper trading. Each keeps only the state its
+# next decision needs, so a new bar costs the same however long the history is, and
+# a PaperTrader makes the same trades as run_decisions() on the same bars (ARIMA as
+# arima_signals(), up to float rounding in the state-space filter).
+
+
+class MomentumStrategy:
+    def __init__(self, period):
+        self.period = period
+        self.window = deque(maxlen=period)
+
+    def on_bar(self, r):
+        # the action for this bar from the returns before it, then r joins the window.
+        # The window is summed in order rather than kept as a running total so the
+        # sign matches decide() exactly near zero.
+        action = 'wait'
+        if len(self.window) == self.period:
+            action = 'buy' if sum(self.window) / self.period > 0 else 'sell'
+        self.window.append(r)
+        return action
+
+
+class MeanReversionStrategy:
+    def __init__(self, period):
+        self.period = period
+        self.window = deque(maxlen=period + 1)
+
+    def on_bar(self, r):
+        action = 'wait'
+        if len(self.window) == self.period + 1:
+            avg_rate = np.mean(list(islice(self.window, self.period)))
+            action = 'buy' if avg_rate > self.window[-1] else 'sell'
+        self.window.append(r)
+        return action
+
+
+class ArimaStrategy:
+    # Refit every refit_every bars (warm-started, on the last `window` returns if
+    # given); in between the fitted model's filter is extended by one return per bar.
+    def __init__(self, order, refit_every=ARIMA_REFIT_EVERY, window=None):
+        self.order = order
+        self.refit_every = refit_every
+        self.window = window
+        self.rate = deque(maxlen=window)
+        self.seen = 0
+        self.res = None
+        self.params = None
+
+    def forecast(self):
+        if self.seen < 31:
+            return np.nan
+        if (self.seen - 31) % self.refit_every == 0:
+            self.res = ARIMA(np.asarray(self.rate), order=self.order).fit(start_params=self.params)
+            self.params = self.res.params
+        else:
+            self.res = self.res.extend(np.asarray([self.rate[-1]]))
+        return self.res.forecast(1)[0]
+
+    def on_bar(self, r):
+        prediction = self.forecast()
+        self.rate.append(r)
+        self.seen += 1
+        if prediction > 0.002:
+            return 'buy'
+        if prediction < -0.002:
+            return 'sell'
+        return 'wait'
+
+
+class RandomStrategy:
+    def on_bar(self, r):
+        return random.choice(['buy', 'sell', 'wait'])
+
+
+def make_strategy(choice, period, order=None):
+    if choice == 'Momentum':
+        return MomentumStrategy(period)
+    if choice == 'Mean Reversion':
+        return MeanReversionStrategy(period)
+    if choice == 'ARIMA':
+        return ArimaStrategy(order)
+    if choice == 'Random':
+        return RandomStrategy()
+    raise ValueError(f'Unknown strategy {choice}')
+
+
+class PaperTrader:
+    # One symbol's account: cash, holdings and the T+2 lockout carried from bar to bar
+    def __init__(self, strategy, amt, position_sizing=1, costs=DEFAULT_COSTS):
+        self.strategy = strategy
+        self.amt = amt
+        self.position_sizing = position_sizing
+        self.costs = cost_model(costs)
+        self.shares = 0
+        self.buy_price = None
+        self.buying_price = []
+        self.trades = []
+        self.last_date = None
+        self.last_close = None
+        self.session_close = None  # the last close of the previous session, the price band's reference
+        self.session = 0
+        self.next_session = 0
+
+    def on_bar(self, date, close):
+        # Returns the action taken at this close: 'buy', 'sell' or 'wait'. Bars no newer
+        # than the last one are ignored, and the first only sets the reference price.
+        date = pd.Timestamp(date)
+        close = float(close)
+        if self.last_date is not None and date <= self.last_date:
+            return 'wait'
+        if self.last_close is None:
+            self.last_date, self.last_close = date, close
+            return 'wait'
+        if date.normalize() != self.last_date.normalize():
+            self.session += 1
+            self.session_close = self.last_close
+        r = close / self.last_close - 1
+        self.last_date, self.last_close = date, close
+        action = self.strategy.on_bar(r)
+        if self.session < self.next_session:
+            return 'wait'
+        band = self.costs.price_band
+        move = None if band is None or self.session_close is None else close / self.session_close - 1
+        limit = self.amt*self.position_sizing
+
+        if action == 'sell' and self.shares > 0 and (move is None or move > -band + BAND_TOLERANCE):
+            self.buy_price = sum(self.buying_price) / len(self.buying_price) if len(self.buying_price) > 0 else self.buy_price
+            self.buying_price.clear()
+            self.amt += close*self.shares*(1 - self.costs.sell_rate(close*self.shares))
+            ret = (close - self.buy_price) / self.buy_price
+            self.trades.append((SELL, date, close, self.shares, ret, self.amt))
+            self.shares = 0
+        elif action == 'buy' and (move is None or move < band - BAND_TOLERANCE) and self.costs.buy_quantity(limit, close) > 0:
+            self.buy_price = close
+            buy_amount = self.costs.buy_quantity(limit, close)
+            self.amt -= close*buy_amount*(1 + self.costs.buy_rate(limit))
+            self.buying_price.append(close)
+            self.trades.append((BUY, date, close, buy_amount, np.nan, self.amt))
+            self.shares += buy_amount
+        else:
+            return 'wait'
+        self.next_session = self.session + self.costs.settlement_days + 1
+        return action
+
+    def replay(self, prices):
+        # Feed a close series through on_bar(), e.g. to warm up on history
+        for date, close in zip(prices.index, prices.to_numpy()):
+            self.on_bar(date, close)
+        return self
+
+    def ledger(self):
+        return TradeLedger.from_rows(self.trades)
+
+    def value(self):
+        return self.amt + self.shares * (self.last_close or 0)
+
+
+def paper_path(name):
+    return os.path.join(DATA_DIR, 'paper', f'{name}.pkl')
+
+
+def start_paper_trading(choice, period, symbols, days_away, amt=100_000_000, order=None, position_sizing=1, costs=DEFAULT_COSTS):
+    # One trader per symbol, each warmed up on its stored closes
+    closes = panel_field(get_stock_panel(symbols, days_away, fields=('close',)), 'close')
+    traders = {}
+    for symbol in closes.columns:
+        trader = PaperTrader(make_strategy(choice, period, order), amt, position_sizing, costs)
+        traders[symbol] = trader.replay(closes[symbol].dropna())
+    return traders
+
+
+def latest_bars(symbols, days_away=7):
+    # {symbol: (date, close)} of each symbol's last stored bar
+    closes = panel_field(get_stock_panel(symbols, days_away, fields=('close',)), 'close')
+    bars = {}
+    for symbol in closes.columns:
+        close = closes[symbol].dropna()
+        if len(close):
+            bars[symbol] = (close.index[-1], close.iloc[-1])
+    return bars
+
+
+def paper_trade(traders, bars):
+    # One new bar per symbol, e.g. today's closes; returns {symbol: action}
+    return {symbol: traders[symbol].on_bar(*bar) for symbol, bar in bars.items() if symbol in traders}
+
+
+def save_traders(traders, name):
+    path = paper_path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_atomic(path, lambda temp: pd.to_pickle(traders, temp))
+
+
+def load_traders(name):
+    path = paper_path(name)
+    return pd.read_pickle(path) if os.path.exists(path) else None
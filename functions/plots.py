@@ -1,10 +1,11 @@
 import streamlit as st
 import numpy as np
-import scipy.stats as stats
-from vnstock import stock_historical_data, stock_screening_insights, financial_ratio
+from vnstock import financial_ratio
+from functions.store import load_prices
+from functions.screener import lookup_ticker
 import pandas as pd
-from statsmodels.graphics.tsaplots import acf, pacf
 from datetime import timedelta, datetime
+from concurrent.futures import ThreadPoolExecutor
 import plotly.express as px
 import plotly.graph_objects as go
 # from langchain_experimental.agents import create_pandas_dataframe_agent
@@ -13,30 +14,93 @@ import plotly.graph_objects as go
 
 # market_df = fr_trade_heatmap(symbol='VNINDEX', report_type='FrBuyVal').T
 
+# Chart payload bounds: about two line points per pixel of a full-width chart, and
+# candlesticks are rolled up to weekly, monthly, ... bars beyond MAX_CANDLES
+MAX_LINE_POINTS = 2000
+MAX_CANDLES = 400
+OHLC_RULES = ['W-FRI', 'ME', 'QE', 'YE']
+INTRADAY_OHLC_RULES = ['1h', 'D']
 
-def get_stock_data(symbol: str, days_away: int):
+
+def get_stock_data(symbol: str, days_away: int, resolution: str = '1D'):
     end_date = datetime.today()
     start_date = end_date - timedelta(days=days_away)
 
-    # Format dates as strings
-    start_date_str = start_date.strftime('%Y-%m-%d')
-    end_date_str = end_date.strftime('%Y-%m-%d')
-
-    df = stock_historical_data(symbol, start_date_str, end_date_str,
-                               "1D", type='stock', source='TCBS') if len(symbol) == 3 else stock_historical_data(symbol, start_date_str, end_date_str,
-                               "1D", type='index', source='TCBS')
+    df = load_prices(symbol, start_date, end_date, resolution=resolution)
     if df is None or df.empty:
         print("Error fetching stock historical data.")
         return ''
-    df.set_index('time', inplace=True)
-    df.index = pd.to_datetime(df.index)
     return df.dropna()
 
 
-def generate_data_plot(df, data_selection):
-    prices = df['close'].dropna()
-    returns = prices.pct_change().dropna()
+def get_stock_panel(symbols, days_away, fields=('open', 'high', 'low', 'close', 'volume'), workers=8, resolution='1D'):
+    # Prices of many symbols on one calendar (every date any of them traded).
+    # Columns are (field, symbol); panel_field(panel, 'close') is a date x symbol frame.
+    # Symbols without data are left out.
+    end_date = datetime.today()
+    start_date = end_date - timedelta(days=days_away)
+
+    def load(symbol):
+        try:
+            return load_prices(symbol, start_date, end_date, resolution=resolution)
+        except Exception as e:
+            print(f"Error fetching {symbol} historical data: {e}")
+
+    with ThreadPoolExecutor(workers) as pool:
+        frames = dict(zip(symbols, pool.map(load, symbols)))
+    frames = {symbol: df.loc[:, list(fields)] for symbol, df in frames.items() if df is not None and not df.empty}
+    if not frames:
+        return pd.DataFrame(columns=pd.MultiIndex.from_product([fields, []]))
+    panel = pd.concat(frames, axis=1).sort_index()
+    panel.columns = panel.columns.swaplevel()
+    return panel.reindex(columns=pd.MultiIndex.from_product([fields, list(frames)]))
+
+
+def panel_field(panel, field):
+    # One field of a get_stock_panel() frame, an empty frame when no symbol had data
+    # (pandas can't select a level value from an empty MultiIndex)
+    if panel.columns.empty:
+        return pd.DataFrame(index=panel.index, columns=pd.Index([], dtype=object))
+    return panel[field]
+
+
+def panel_array(panel):
+    # get_stock_panel() frame as one contiguous symbol x date x field float array
+    fields = panel.columns.get_level_values(0).unique()
+    values = panel.to_numpy(dtype=float).reshape(len(panel), len(fields), -1)
+    return np.ascontiguousarray(values.transpose(2, 0, 1))
+
+
+def minmax_downsample(series, max_points=MAX_LINE_POINTS):
+    # Keeps the first and last point and the low and high of each of max_points / 2
+    # equal buckets, in time order, so spikes survive and the trace stays bounded
+    if len(series) <= max_points:
+        return series
+    values = series.to_numpy(dtype=float)
+    buckets = max_points // 2
+    edges = np.linspace(0, len(values), buckets + 1).astype(int)
+    ids = np.repeat(np.arange(buckets), np.diff(edges))
+    order = np.lexsort((values, ids))  # ascending within each bucket
+    keep = np.concatenate([[0, len(values) - 1], order[edges[:-1]], order[edges[1:] - 1]])
+    return series.iloc[np.unique(keep)]
+
+
+def resample_ohlc(df, max_bars=MAX_CANDLES):
+    # Bars rolled up into the shortest period (hour, day, week, month, ...) that fits max_bars
+    if len(df) <= max_bars:
+        return df
+    intraday = df.index.normalize().has_duplicates
+    for rule in (INTRADAY_OHLC_RULES if intraday else []) + OHLC_RULES:
+        bars = df.resample(rule).agg({'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last'}).dropna()
+        if len(bars) <= max_bars:
+            break
+    return bars
+
+
+def generate_data_plot(analytics, data_selection):
+    df = analytics.df
     if data_selection == 'Candlestick':
+        df = resample_ohlc(df)
         fig = go.Figure(data=[go.Candlestick(x=df.index.values,
                               open=df['open'],
                               high=df['high'],
@@ -59,7 +123,7 @@ def generate_data_plot(df, data_selection):
                          linecolor='white',
                          mirror=True)
         return fig
-    data = prices if data_selection == 'Price' else returns
+    data = minmax_downsample(df['close'] if data_selection == 'Price' else analytics.returns())
     fig = go.Figure()
     fig.add_trace(go.Scatter(
         x=data.index.values,
@@ -87,15 +151,17 @@ def generate_data_plot(df, data_selection):
     return fig
 
 
-def generate_histogram_plot(df):
-    prices = df['close'].dropna()
-    returns = prices.pct_change().dropna()
-
-    kde = stats.gaussian_kde(returns)
-    x_vals = np.linspace(returns.min(), returns.max(), 1000)
-    kde_vals = kde.evaluate(x_vals)
+def generate_histogram_plot(analytics):
+    x_vals, kde_vals = analytics.kde()
+    binned = analytics.histogram()
 
-    histogram = go.Histogram(x=returns, histnorm='probability density', name='Returns', showlegend=False, marker=dict(color='#1F77B4', line=dict(color='white', width=1)))
+    marker = dict(color='#1F77B4', line=dict(color='white', width=1))
+    if binned is None:
+        histogram = go.Histogram(x=analytics.returns(), histnorm='probability density', name='Returns', showlegend=False, marker=marker)
+    else:
+        # long histories are sent as pre-binned bars rather than every return
+        centres, width, density = binned
+        histogram = go.Bar(x=centres, y=density, width=width, name='Returns', showlegend=False, marker=marker)
     kde_line = go.Scatter(x=x_vals, y=kde_vals, mode='lines', name='KDE', line=dict(color = 'white'), showlegend=False)
     fig = go.Figure(data=[histogram, kde_line])
 
@@ -120,18 +186,16 @@ def generate_histogram_plot(df):
     return fig
 
 
-def generate_acf_plots(series, plot_pacf=False):
-    corr_array = pacf(series.dropna(), alpha=0.05) if plot_pacf else acf(series.dropna(), alpha=0.05)
-    lower_y = corr_array[1][:,0] - corr_array[0]
-    upper_y = corr_array[1][:,1] - corr_array[0]
+def generate_acf_plots(analytics, plot_pacf=False):
+    corr, lower_y, upper_y = analytics.correlogram(partial=plot_pacf)
 
     fig = go.Figure()
-    [fig.add_scatter(x=(x,x), y=(0,corr_array[0][x]), mode='lines', line_color='#3f3f3f')
-        for x in range(len(corr_array[0]))]
-    fig.add_scatter(x=np.arange(len(corr_array[0])), y=corr_array[0], mode= 'markers', marker_color='#1F77B4',
+    [fig.add_scatter(x=(x,x), y=(0,corr[x]), mode='lines', line_color='#3f3f3f')
+        for x in range(len(corr))]
+    fig.add_scatter(x=np.arange(len(corr)), y=corr, mode= 'markers', marker_color='#1F77B4',
                     marker_size=12)
-    fig.add_scatter(x=np.arange(len(corr_array[0])), y=upper_y, mode='lines', line_color='rgba(255,255,255,0)')
-    fig.add_scatter(x=np.arange(len(corr_array[0])), y=lower_y, mode='lines', fillcolor='rgba(32, 146, 230,0.2)',
+    fig.add_scatter(x=np.arange(len(corr)), y=upper_y, mode='lines', line_color='rgba(255,255,255,0)')
+    fig.add_scatter(x=np.arange(len(corr)), y=lower_y, mode='lines', fillcolor='rgba(32, 146, 230,0.2)',
                     fill='tonexty', line_color='rgba(255,255,255,0)')
     fig.update_traces(showlegend=False)
     fig.update_xaxes(range=[-1, 20], showline=True,
@@ -147,13 +211,8 @@ def generate_acf_plots(series, plot_pacf=False):
     return fig
 
 
-def generate_scatter_plot(df, days_away):
-    # Extract prices and returns
-    prices = df['close'].dropna()
-    returns = prices.pct_change().dropna()
-    market_prices = get_stock_data('VNINDEX', days_away)
-    market_prices = market_prices['close'].dropna()
-    market_returns = market_prices.pct_change().dropna()
+def generate_scatter_plot(analytics):
+    returns, market_returns = analytics.market_returns()
 
 # Plot the scatter plot with marginal histograms
     fig = px.scatter(x=returns, y=market_returns,
@@ -194,9 +253,4 @@ def generate_ai_analysis(df, key):
 
 
 def get_basic_data(symbol):
-    params = {
-        'exchangeName': 'HOSE,HNX',
-    }
-    df = stock_screening_insights(params, size=1700, drop_lang='vi')
-    df = df[df['ticker'] == symbol].loc[:, ['marketCap', 'exchangeName.en', 'industryName.en']]
-    return df
+    return lookup_ticker(symbol, ['marketCap', 'exchangeName.en', 'industryName.en'])
@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+from functions.plots import get_stock_panel, panel_field
+from functions.ledger import LEDGER_DTYPE, BUY, SELL, TradeLedger
+from functions.simulation import panel_signals, analyze, market_tickers
+from functions.costs import DEFAULT_COSTS, cost_model
+
+# Many symbols traded from one cash pool on one date axis. Each day every symbol's
+# signal is evaluated at once; sells settle (and free their cash) after T+2, and the
+# day's buy signals share position_sizing of the available cash equally.
+PORTFOLIO_CHOICES = ('Momentum', 'Mean Reversion')
+
+
+def portfolio_prices(symbols, days_away):
+    # date x symbol closes and returns; a symbol's returns start on its second bar
+    closes = panel_field(get_stock_panel(symbols, days_away, fields=('close',)), 'close').astype(float)
+    closes = closes[~closes.index.duplicated(keep='first')]
+    returns = closes.pct_change(fill_method=None).iloc[1:]
+    return closes.iloc[1:], returns
+
+
+def run_portfolio(signals, dates, prices, amt, position_sizing, costs=DEFAULT_COSTS):
+    # signals, prices: days x symbols arrays, prices nan where a symbol did not trade.
+    # With one symbol this makes the same trades as run_signals().
+    costs = cost_model(costs)
+    n, m = signals.shape
+    unlock = costs.settlement_unlock(dates)
+    can_buy, can_sell = costs.fillable(pd.DataFrame(prices).ffill().to_numpy(), dates)
+    dates = pd.DatetimeIndex(dates).to_numpy()
+    cash = amt
+    unsettled = 0.0
+    settling = np.zeros(n + 1)
+    shares = np.zeros(m, dtype=np.int64)
+    buy_sum = np.zeros(m)
+    buy_count = np.zeros(m, dtype=np.int64)
+    next_trade = np.zeros(m, dtype=np.int64)
+    marks = np.full(m, np.nan)
+    equity = np.empty(n)
+    rows = []  # (symbol index, trade) in the order they happened
+
+    for i in range(n):
+        cash += settling[i]
+        unsettled -= settling[i]
+        price = prices[i]
+        traded = ~np.isnan(price)
+        marks[traded] = price[traded]
+        tradable = traded & (next_trade <= i)
+
+        sells = np.flatnonzero(tradable & can_sell[i] & (signals[i] == SELL) & (shares > 0))
+        for k in sells:
+            buy_price = buy_sum[k] / buy_count[k]
+            proceeds = price[k]*shares[k]*(1 - costs.sell_rate(price[k]*shares[k]))
+            unsettled += proceeds
+            settling[unlock[i]] += proceeds
+            rows.append((k, (SELL, dates[i], price[k], shares[k], (price[k] - buy_price) / buy_price, cash + unsettled)))
+        shares[sells] = 0
+        buy_sum[sells] = 0
+        buy_count[sells] = 0
+        next_trade[sells] = unlock[i]
+
+        candidates = tradable & can_buy[i] & (signals[i] == BUY)
+        if candidates.any():
+            budget = cash*position_sizing / candidates.sum()
+            buy_cost = 1 + costs.buy_rate(budget)
+            for k in np.flatnonzero(candidates & (price*buy_cost*costs.lot_size < budget)):
+                qty = costs.buy_quantity(budget, price[k])
+                cash -= price[k]*qty*buy_cost
+                shares[k] += qty
+                buy_sum[k] += price[k]
+                buy_count[k] += 1
+                next_trade[k] = unlock[i]
+                rows.append((k, (BUY, dates[i], price[k], qty, np.nan, cash + unsettled)))
+
+        equity[i] = cash + unsettled + np.nansum(shares * marks)
+
+    trades = np.array([trade for _, trade in rows], dtype=LEDGER_DTYPE)
+    return np.array([k for k, _ in rows], dtype=np.int64), TradeLedger(trades), equity, shares
+
+
+def portfolio_backtest(choice, period, symbols=None, days_away=365, amt=100_000_000, position_sizing=1, costs=DEFAULT_COSTS):
+    # Returns (trades frame with a symbol column, daily equity, analyze() stats)
+    if choice not in PORTFOLIO_CHOICES:
+        raise ValueError(f'The portfolio engine runs {", ".join(PORTFOLIO_CHOICES)}, not {choice}')
+    if symbols is None:
+        symbols = market_tickers()
+    closes, returns = portfolio_prices(symbols, days_away)
+    signals = panel_signals(choice, period, returns.to_numpy())
+    traded_symbols, ledger, equity, shares = run_portfolio(signals, returns.index, closes.to_numpy(), amt, position_sizing, costs)
+    equity = pd.Series(equity, index=returns.index, name='equity')
+    total_asset = round(equity.iloc[-1] / 1000000, 2) if len(equity) else amt / 1000000
+    stats = analyze(ledger, amt, total_asset, equity=equity) if len(equity) else analyze(ledger, amt, total_asset)
+    trades = ledger.to_frame()
+    trades.insert(0, 'symbol', closes.columns[traded_symbols])
+    return trades, equity, stats
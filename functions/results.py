@@ -0,0 +1,130 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from functions.plots import get_stock_data
+from functions.store import DATA_DIR, write_atomic
+from functions.simulation import test_market, market_tickers
+
+# Market-wide backtest results, one Parquet table per (strategy, period or order,
+# days_away, position sizing, code version) with a row per ticker: its market_stats()
+# and the error if it could not be tested. Each row records the first and last bar it
+# was computed on, so a run only recomputes the tickers whose window moved, and
+# queries read the stored table.
+CODE_FILES = ('simulation.py', 'ledger.py', 'costs.py')  # the code the stats depend on
+RESULT_COLUMNS = ['Turnover', 'Sharpe', 'Margin', 'Return', 'Trades', 'start', 'asOf', 'error']
+_tables = {}  # path: (mtime, table)
+_lock = threading.Lock()
+_version = None
+
+
+def code_version():
+    global _version
+    if _version is None:
+        digest = hashlib.sha1()
+        for name in CODE_FILES:
+            with open(os.path.join(os.path.dirname(__file__), name), 'rb') as f:
+                digest.update(f.read())
+        _version = digest.hexdigest()[:12]
+    return _version
+
+
+def result_key(choice, period, days_away, position_sizing=1, order=0):
+    return choice, order if choice == 'ARIMA' else period, days_away, position_sizing, code_version()
+
+
+def results_path(key):
+    choice, param, days_away, position_sizing, version = key
+    if isinstance(param, (tuple, list)):
+        param = '.'.join(map(str, param))
+    name = f'{choice.replace(" ", "")}-{param}-{days_away}-{position_sizing}-{version}'
+    return os.path.join(DATA_DIR, 'results', f'{name}.parquet')
+
+
+def load_results(key):
+    # The stored table indexed by ticker, empty if nothing was run for key yet
+    path = results_path(key)
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=RESULT_COLUMNS, index=pd.Index([], name='ticker'))
+    mtime = os.path.getmtime(path)
+    with _lock:
+        cached = _tables.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    table = pd.read_parquet(path)
+    with _lock:
+        _tables[path] = (mtime, table)
+    return table
+
+
+def save_results(key, table):
+    path = results_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_atomic(path, table.to_parquet)
+    with _lock:
+        _tables[path] = (os.path.getmtime(path), table)
+
+
+def price_windows(tickers, days_away, workers=8):
+    # {ticker: (first bar, last bar)} of the window a backtest would run on
+    def window(ticker):
+        try:
+            prices = get_stock_data(ticker, days_away)
+        except Exception:
+            return None
+        return (prices.index[0], prices.index[-1]) if len(prices) else None
+
+    with ThreadPoolExecutor(workers) as pool:
+        windows = dict(zip(tickers, pool.map(window, tickers)))
+    return {ticker: window for ticker, window in windows.items() if window is not None}
+
+
+def stale_tickers(key, tickers=None, workers=8):
+    # The tickers that are new, failed last time, or whose price window has moved
+    table = load_results(key)
+    if tickers is None:
+        tickers = market_tickers()
+    windows = price_windows(tickers, key[2], workers)
+    stale = []
+    for ticker in tickers:
+        if ticker not in table.index or pd.notna(table.at[ticker, 'error']):
+            stale.append(ticker)
+        elif windows.get(ticker) != (table.at[ticker, 'start'], table.at[ticker, 'asOf']):
+            stale.append(ticker)
+    return stale
+
+
+def merge_results(table, rows):
+    rows = pd.DataFrame.from_dict(rows, orient='index').reindex(columns=RESULT_COLUMNS)
+    rows.index.name = 'ticker'
+    if table.empty:
+        return rows
+    return pd.concat([table.drop(rows.index, errors='ignore'), rows])
+
+
+def update_results(key, tickers, workers=None, timeout=None, save_every=50):
+    # Runs test_market() on tickers (e.g. stale_tickers()) and yields what it yields,
+    # with market_stats() as the value. Results are saved every save_every tickers and
+    # when the generator is closed, so an interrupted run keeps what it got.
+    choice, param, days_away, position_sizing, _ = key
+    period, order = (None, param) if choice == 'ARIMA' else (param, 0)
+    rows = {}
+    try:
+        for ticker, stats, error in test_market(choice, period, days_away, workers=workers, timeout=timeout, order=order,
+                                                tickers=tickers, position_sizing=position_sizing, stats=True):
+            rows[ticker] = {**(stats or {}), 'error': error}
+            yield ticker, stats, error
+            if len(rows) >= save_every:
+                save_results(key, merge_results(load_results(key), rows))
+                rows = {}
+    finally:
+        if rows:
+            save_results(key, merge_results(load_results(key), rows))
+
+
+def top_results(key, n=50, by='Return', ascending=False):
+    # e.g. the top 50 winners; top_results(key, ascending=True) for the worst losers
+    table = load_results(key)
+    table = table[table['error'].isna()]
+    return table.nsmallest(n, by) if ascending else table.nlargest(n, by)
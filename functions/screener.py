@@ -0,0 +1,81 @@
+import os
+import threading
+from datetime import datetime, timedelta
+import pandas as pd
+from vnstock import stock_screening_insights
+from functions.store import DATA_DIR, write_atomic
+
+# One screener download of the whole HOSE/HNX universe, shared by every page and
+# persisted next to the price store. It is refreshed once it is older than SNAPSHOT_TTL.
+SNAPSHOT_TTL = timedelta(hours=6)
+SNAPSHOT_PARAMS = {'exchangeName': 'HOSE,HNX'}
+_lock = threading.Lock()
+_snapshot = None
+
+
+def snapshot_path():
+    return os.path.join(DATA_DIR, 'screener.pkl')
+
+
+def _index(as_of, data):
+    return {
+        'as_of': as_of,
+        'data': data,
+        'tickers': {ticker: i for i, ticker in enumerate(data['ticker'])},
+        'industries': data.groupby('industryName.en').indices,
+        'derived': {},
+    }
+
+
+def load_snapshot(max_age=SNAPSHOT_TTL):
+    global _snapshot
+    with _lock:
+        path = snapshot_path()
+        if _snapshot is None and os.path.exists(path):
+            _snapshot = _index(*pd.read_pickle(path))
+        if _snapshot is None or datetime.today() - _snapshot['as_of'] > max_age:
+            try:
+                data = stock_screening_insights(SNAPSHOT_PARAMS, size=1700, drop_lang='vi').reset_index(drop=True)
+            except Exception:
+                if _snapshot is None:
+                    raise
+                print("Error refreshing the screener, serving the stored snapshot.")
+                return _snapshot
+            as_of = datetime.today()
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_atomic(path, lambda temp: pd.to_pickle((as_of, data), temp))
+            _snapshot = _index(as_of, data)
+        return _snapshot
+
+
+def screener(min_market_cap=None):
+    data = load_snapshot()['data']
+    if min_market_cap is not None:
+        data = data[data['marketCap'] >= min_market_cap].reset_index(drop=True)
+    return data.copy()
+
+
+def screener_as_of():
+    return load_snapshot()['as_of']
+
+
+def lookup_ticker(symbol, columns=None):
+    # One-row frame for symbol (empty if it is not in the universe)
+    snapshot = load_snapshot()
+    data = snapshot['data'] if columns is None else snapshot['data'].loc[:, columns]
+    position = snapshot['tickers'].get(symbol)
+    return data.iloc[[] if position is None else [position]]
+
+
+def industry_members(industry, columns=None):
+    snapshot = load_snapshot()
+    data = snapshot['data'] if columns is None else snapshot['data'].loc[:, columns]
+    return data.iloc[snapshot['industries'].get(industry, [])]
+
+
+def snapshot_cached(key, compute):
+    # compute() once per snapshot; results are dropped when the snapshot refreshes
+    derived = load_snapshot()['derived']
+    if key not in derived:
+        derived[key] = compute()
+    return derived[key]
@@ -1,6 +1,12 @@
-from functions.plots import get_stock_data
+from functions.plots import get_stock_panel, panel_field
+from functions.screener import screener, snapshot_cached
+from functions.indicators import load_indicators, query_indicators
 from vnstock import stock_historical_data, stock_screening_insights, fr_trade_heatmap, financial_ratio
+import threading
+from datetime import date
+import numpy as np
 import pandas as pd
+from cachetools import LRUCache
 
 fundamental_selections = {
     'PE < 20': {'pe': (0, 20)},
@@ -12,10 +18,19 @@ technical_selections = {
     'RSI14 < 30': {'rsi14': (0, 30)},
 }
 
+SPARKLINE_POINTS = 64
+_sparkline_cache = LRUCache(maxsize=8192)
+_sparkline_lock = threading.Lock()
 
-def filter_stock(df, params, industry):
+
+def filter_stock(df, params, industry, indicator_ranges=None):
     if industry:
         df = df[df['industryName.en'] == industry]
+    if indicator_ranges:
+        # {indicator: (low, high)} over the precomputed indicator table
+        table = query_indicators(load_indicators(), indicator_ranges)
+        shown = [column for column in indicator_ranges if column not in df.columns]
+        df = df.merge(table[shown], left_on='ticker', right_index=True)
     for key, value in params.items():
         if value is not None:
             if key in ['pe', 'pb', 'rsi14']:
@@ -27,14 +42,7 @@ def filter_stock(df, params, industry):
 
     if df.empty:
         return df
-    sorted_df = df.sort_values(by=['industryName.en', 'marketCap'], ascending=[True, False])
-    top_stock_market_cap = sorted_df.groupby('industryName.en')['marketCap'].first().reset_index()
-    top_stock_market_cap = top_stock_market_cap.rename(columns={'marketCap': 'topStockMarketCap'})
-    top_stock_market_cap = top_stock_market_cap.sort_values(by='topStockMarketCap', ascending=False)
-    result_df = pd.DataFrame(columns=df.columns)
-    for industry in top_stock_market_cap['industryName.en']:
-        industry_symbols = sorted_df[sorted_df['industryName.en'] == industry]
-        result_df = pd.concat([result_df, industry_symbols], ignore_index=True)
+    result_df = reorder_stocks(df)
 
     def highlight_industry_row(row):
         return ['background-color: #1a1c24' if row.name % 2 == 0 else '' for _ in row]
@@ -47,61 +55,73 @@ def filter_stock(df, params, industry):
 
 
 def reorder_stocks(df):
-    sorted_df = df.sort_values(by=['industryName.en', 'marketCap'], ascending=[True, False])
-    top_stock_market_cap = sorted_df.groupby('industryName.en')['marketCap'].first().reset_index()
-    top_stock_market_cap = top_stock_market_cap.rename(columns={'marketCap': 'topStockMarketCap'})
-    top_stock_market_cap = top_stock_market_cap.sort_values(by='topStockMarketCap', ascending=False)
-    result_df = pd.DataFrame(columns=df.columns)
-    for industry in top_stock_market_cap['industryName.en']:
-        industry_symbols = sorted_df[sorted_df['industryName.en'] == industry]
-        result_df = pd.concat([result_df, industry_symbols], ignore_index=True)
-    return result_df
+    # Industries by their largest company's market cap, then companies by market cap,
+    # in one sort. Rows without an industry are left out.
+    df = df.dropna(subset=['industryName.en'])
+    top_stock_market_cap = df.groupby('industryName.en')['marketCap'].transform('max')
+    return (df.assign(topStockMarketCap=top_stock_market_cap)
+              .sort_values(by=['topStockMarketCap', 'industryName.en', 'marketCap'], ascending=[False, True, False])
+              .drop(columns='topStockMarketCap')
+              .reset_index(drop=True))
 
 
 def calculate_market(df):
-    sorted_df = df.sort_values(by=['industryName.en', 'marketCap'], ascending=[True, False])
-    top_stock_market_cap = sorted_df.groupby('industryName.en')['marketCap'].first().reset_index()
-    top_stock_market_cap = top_stock_market_cap.rename(columns={'marketCap': 'topStockMarketCap'})
-    top_stock_market_cap = top_stock_market_cap.sort_values(by='topStockMarketCap', ascending=False)
-    result_df = pd.DataFrame(columns=df.columns)
-    for industry in top_stock_market_cap['industryName.en']:
-        industry_symbols = sorted_df[sorted_df['industryName.en'] == industry]
-        result_df = pd.concat([result_df, industry_symbols.dropna(axis=1, how='all')], ignore_index=True)
-    total_market_cap_by_industry = result_df.groupby('industryName.en')['marketCap'].sum()
-    result_df['industryMarketCapWeight'] = result_df.groupby('industryName.en')['marketCap'].transform(lambda x: x / x.sum())
-    result_df['weightedPE'] = result_df['pe'] * result_df['industryMarketCapWeight']
-    result_df['weightedPB'] = result_df['pb'] * result_df['industryMarketCapWeight']
-    result_df['weightedROE'] = result_df['roe'] * result_df['industryMarketCapWeight']
-    total_weighted_PE = result_df.groupby('industryName.en')['weightedPE'].sum()
-    total_weighted_PB = result_df.groupby('industryName.en')['weightedPB'].sum()
-    total_weighted_ROE = result_df.groupby('industryName.en')['weightedROE'].sum()
-
-    industry_ratios_df = pd.DataFrame({
-        'Industry_PE_ratio': total_weighted_PE,
-        'Industry_PB_ratio': total_weighted_PB,
-        'Industry_ROE_ratio': total_weighted_ROE,
-        'Industry_Market_Cap': total_market_cap_by_industry
-    })
-    return industry_ratios_df
-
-
-def compare_stocks(df, symbol_list):
-    market_df = calculate_market(df)
+    # Market-cap weighted PE/PB/ROE and total market cap of every industry
+    df = df.dropna(subset=['industryName.en'])
+    industry = df['industryName.en']
+    weight = df['marketCap'] / df.groupby(industry)['marketCap'].transform('sum')
+    return pd.DataFrame({
+        'Industry_PE_ratio': df['pe'] * weight,
+        'Industry_PB_ratio': df['pb'] * weight,
+        'Industry_ROE_ratio': df['roe'] * weight,
+        'Industry_Market_Cap': df['marketCap'],
+    }).groupby(industry).sum()
+
+
+def market_table(min_market_cap=None):
+    # calculate_market() of the screener universe, computed once per snapshot
+    return snapshot_cached(('market_table', min_market_cap), lambda: calculate_market(screener(min_market_cap)))
+
+
+def sparkline(close, points=SPARKLINE_POINTS):
+    # Change from the first close, scaled by the close range, on at most `points` evenly spaced bars
+    close = close.dropna().to_numpy(dtype=float)
+    if len(close) == 0:
+        return np.zeros(0, dtype=np.float32)
+    if len(close) > points:
+        close = close[np.linspace(0, len(close) - 1, points).round().astype(int)]
+    return ((close - close[0]) / (close.max() - close.min())).astype(np.float32)
+
+
+def sparklines(symbols, days_away, points=SPARKLINE_POINTS):
+    # {symbol: sparkline}, cached per (symbol, window, day) so repeat and overlapping
+    # comparisons only fetch the symbols they have not seen today
+    as_of = date.today()
+    with _sparkline_lock:
+        lines = {symbol: _sparkline_cache.get((symbol, days_away, points, as_of)) for symbol in symbols}
+    missing = [symbol for symbol, line in lines.items() if line is None]
+    if missing:
+        closes = panel_field(get_stock_panel(missing, days_away, fields=('close',)), 'close')
+        with _sparkline_lock:
+            for symbol in missing:
+                if symbol not in closes:
+                    # a failed fetch is retried on the next comparison, not cached for the day
+                    lines[symbol] = np.zeros(0, dtype=np.float32)
+                    continue
+                lines[symbol] = sparkline(closes[symbol], points)
+                _sparkline_cache[(symbol, days_away, points, as_of)] = lines[symbol]
+    return lines
+
+
+def compare_stocks(df, symbol_list, market_df=None):
+    if market_df is None:
+        market_df = calculate_market(df)
     df = df[df['ticker'].isin(symbol_list)].loc[:, ['ticker', 'marketCap', 'pe', 'pb', 'roe', 'industryName.en', 'revenueGrowth1Year',]]
     df = reorder_stocks(df)
     new_rows = []
     current_industry = None
-    price_changes = []
-    for symbol in df['ticker']:
-        df2 = get_stock_data(symbol, 180)['close']
-        first_value = df2.iloc[0]
-        min_value = df2.min()
-        max_value = df2.max()
-        scaled_df = (df2 - first_value) / (max_value - min_value)
-        changes = scaled_df.tolist()
-        price_changes.append(changes)
-
-    df['price_change'] = price_changes
+    lines = sparklines(df['ticker'].tolist(), 180)
+    df['price_change'] = [lines[symbol].tolist() for symbol in df['ticker']]
 
     for index, row in df.iterrows():
         if row['industryName.en'] != current_industry:
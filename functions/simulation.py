@@ -3,14 +3,25 @@ import numpy as np
 import pandas as pd
 from statsmodels.tsa.arima.model import ARIMA
 from scipy.stats import rv_histogram
+from numpy.lib.stride_tricks import sliding_window_view
 from tqdm import tqdm
-from functions.plots import get_stock_data, stock_screening_insights
+from functions.plots import get_stock_data
+from functions.screener import screener
+from functions.ledger import TradeLedger, BUY, SELL
+from functions.costs import DEFAULT_COSTS, cost_model
 from vnstock import general_rating
 import random
+import os
+import time
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 import matplotlib
-from statsmodels.tools.sm_exceptions import ConvergenceWarning
+from statsmodels.tools.sm_exceptions import ConvergenceWarning, EstimationWarning
 import warnings
 warnings.filterwarnings('ignore', category=ConvergenceWarning)
+warnings.filterwarnings('ignore', category=EstimationWarning)
 
 matplotlib.use('Agg')
 custom_dark_colors = {
@@ -26,21 +37,62 @@ custom_dark_colors = {
 plt.rcParams.update(custom_dark_colors)
 
 
-def calculate_next_wealth(f, current_wealth):
-    df = get_stock_data(symbol, days_away=days_away)
-    prices = df['close']
-    returns = prices.pct_change().dropna()
-    counts, bins, _ = plt.hist(returns, bins=100, color='blue', alpha=0.7)
-    histogram_rv = rv_histogram((counts, bins))
-    sample = histogram_rv.rvs(size=1)
-    return current_wealth * ((1-f) + f * 0.9975 * (1 + max(sample, -100)) * 0.9965)
-
-
-def calculate_final_return(f, iterations):
-    cur_wealth = 1
-    for _ in range(iterations):
-        cur_wealth = calculate_next_wealth(f, cur_wealth)
-    return cur_wealth
+BUY_FEE = DEFAULT_COSTS.fee_rate(0)  # the transaction fee alone, charged on the buy side by the sizing model
+SELL_COST = DEFAULT_COSTS.sell_rate(0)  # 0.25% transaction fee + 0.1% tax, taken when selling
+LOCKOUT_DAYS = DEFAULT_COSTS.settlement_days  # T+2: no trading for the two sessions after a trade
+KELLY_FRACTIONS = np.linspace(0, 1, 101)
+KELLY_GROUPS = 20
+KELLY_BLOCK = 5_000_000  # samples x fractions evaluated per pass
+
+
+def calculate_next_wealth(f, current_wealth, sample, costs=DEFAULT_COSTS):
+    # Wealth after putting fraction f of it into one return `sample`, paying the transaction
+    # fee on the buy and the sell cost of costs (BUY_FEE and SELL_COST by default).
+    # Arguments broadcast, so whole grids of f and paths go at once.
+    costs = cost_model(costs)
+    return current_wealth * ((1-f) + f * (1 - costs.fee_rate(0)) * (1 + np.maximum(sample, -100)) * (1 - costs.sell_rate(0)))
+
+
+def calculate_final_return(f, samples, costs=DEFAULT_COSTS):
+    # Wealth after every step along the last axis of samples, starting from 1
+    return np.exp(np.log(calculate_next_wealth(f, 1, samples, costs)).sum(axis=-1))
+
+
+def kelly_sizing(prices, fractions=KELLY_FRACTIONS, steps=250, paths=2000, horizon=1, seed=None, costs=DEFAULT_COSTS):
+    # Monte-Carlo Kelly: paths x steps returns over `horizon` bars (one trade each) are
+    # drawn once from their empirical distribution and replayed for every fraction.
+    # Returns the fraction with the best expected log growth, a 90% band for it (from
+    # KELLY_GROUPS independent groups of paths) and a table of growth per step and final
+    # wealth percentiles for every fraction.
+    prices = prices[~prices.index.duplicated(keep='first')]
+    returns = prices.pct_change(horizon).dropna().to_numpy()
+    histogram_rv = rv_histogram(np.histogram(returns, bins=100))
+    samples = histogram_rv.rvs(size=(paths, steps), random_state=np.random.default_rng(seed))
+    # calculate_next_wealth(f, 1, sample) is 1 + f * net, so log1p(f * net) is its log
+    net = calculate_next_wealth(1, 1, samples, costs) - 1
+    fractions = np.asarray(fractions, dtype=float)
+    log_wealth = np.empty((len(fractions), paths))
+    block = max(1, KELLY_BLOCK // samples.size)  # fractions per pass, to bound memory
+    for start in range(0, len(fractions), block):
+        f = fractions[start:start + block, None, None]
+        log_wealth[start:start + block] = np.log1p(f * net).sum(axis=-1)
+
+    growth = log_wealth.mean(axis=1) / steps
+    best = fractions[np.argmax(growth)]
+    groups = log_wealth[:, :paths - paths % KELLY_GROUPS].reshape(len(fractions), KELLY_GROUPS, -1).mean(axis=2)
+    band = tuple(np.percentile(fractions[np.argmax(groups, axis=0)], [5, 95]))
+    low, median, high = np.exp(np.percentile(log_wealth, [5, 50, 95], axis=1))
+    table = pd.DataFrame({'Growth': growth, 'Wealth 5%': low, 'Wealth 50%': median, 'Wealth 95%': high},
+                         index=pd.Index(fractions, name='f'))
+    return best, band, table
+
+
+def lockout_bars(dates, costs=DEFAULT_COSTS):
+    # Bars a position is held at least: the settlement lockout plus the session it was
+    # bought in, at the median number of bars per session (1 per session on daily bars)
+    costs = cost_model(costs)
+    per_session = np.bincount(costs.sessions(dates)) if len(dates) else [1]
+    return max(1, round(np.median(per_session))) * (costs.settlement_days + 1)
 
 
 def calculate_position_sizing(symbol, prices):
@@ -56,132 +108,279 @@ def calculate_position_sizing(symbol, prices):
     return (CAPM_return*p + (1-p))/CAPM_return
 
 
-def analyze(events_list, amt, total_asset):
-    trading_volume = 0  # Total dollar trading volume
-    total_shares_held = 0  # Total number of shares held
-    book_size = amt  # Initial book size
-    pnl_values = []
-    if not events_list:
+def analyze(ledger, amt, total_asset, equity=None):
+    # equity: the daily value of a portfolio backtest (functions/portfolio.py). Turnover,
+    # Sharpe (annualized) and Margin then come from the daily marks instead of the trade book.
+    if not isinstance(ledger, TradeLedger):
+        ledger = TradeLedger.from_events(ledger)
+    if equity is not None:
+        equity = np.asarray(equity, dtype=float)
+        daily = np.diff(equity) / equity[:-1]
+        std_dev_daily = np.std(daily) if len(daily) else 0
+        traded = (ledger.price * ledger.qty).sum()
+        return {'Turnover': round(traded / equity.mean() * 100, 2),
+                'Sharpe': round(np.mean(daily) / std_dev_daily * np.sqrt(252), 2) if std_dev_daily != 0 else np.nan,
+                'Margin': round((equity[-1] - equity[0]) / traded, 4) if traded else np.nan,
+                'Return': total_asset/100 - 1}
+    if not len(ledger):
         return {'Turnover': 0, 'Sharpe': np.nan, 'Margin': np.nan, 'Return': 0}
+    average_pnl = np.mean(ledger.pnl(amt))
+    return {'Turnover': round(ledger.turnover(amt), 2), 'Sharpe': round(ledger.sharpe(amt), 2), 'Margin': round(average_pnl/ledger.trading_volume(), 2), 'Return': total_asset/100 - 1}
 
-    for event in events_list:
-        cur_price = event[2]
-        if event[0] == 'b':
-            total_shares_held += event[3]  # Increment shares held when buying
-            trading_volume += cur_price
-            amt += cur_price  # Increment trading volume when buying
-        elif event[0] == 's':
-            total_shares_held -= event[4]  # Decrement shares held when selling
-            trading_volume += cur_price  # Increment trading volume when selling
-        # Calculate book size as the total value of assets held (price * number of shares)
-        final_book_size = total_shares_held * cur_price + amt
-        # Assuming the last price reflects the current price
-        pnl = (final_book_size - book_size)/book_size
-        pnl_values.append(pnl)
-        book_size = final_book_size
-    average_pnl = np.mean(pnl_values)
-    std_dev_pnl = np.std(pnl_values)
-    if std_dev_pnl != 0:  # Avoid division by zero
-        pnl_ratio = average_pnl / std_dev_pnl
-    else:
-        pnl_ratio = np.nan
-    book_size = final_book_size if final_book_size > 0 else 0
-    # Calculate daily turnover
-    if book_size != 0:
-        daily_turnover = (trading_volume / book_size) * 100
-    else:
-        daily_turnover = 0
-    return {'Turnover': round(daily_turnover, 2), 'Sharpe': round(pnl_ratio, 2), 'Margin': round(average_pnl/trading_volume, 2), 'Return': total_asset/100 - 1}
-
-
-def simulate_trading(choice, period, symbol, days_away, amt, order, position_sizing, verbose=False, plot=True):
-    def decide(rate, choice, period, order):
-        if choice == 'Random':
-            return random.choice(['buy', 'sell', 'wait'])
-        if choice == 'Momentum':
-            if len(rate) < period:
-                return 'wait'
-            if sum(rate[-period:]) / period > 0:
-                return 'buy'
-            return 'sell'
-        if choice == 'Mean Reversion':
-            if len(rate) < period + 1:
-                return 'wait'
-            avg_rate = np.mean(rate[-(period+1):-1])
-            if avg_rate > rate[-1]:
-                return 'buy'
-            return 'sell'
-        if choice == 'ARIMA':
-            if len(rate) > 30:
-                model = ARIMA(rate, order=order).fit()
-                prediction = model.forecast(steps=1)
-                if prediction > 0.002:
-                    return 'buy'
-                if prediction < -0.002:
-                    return 'sell'
+
+VECTORIZED_CHOICES = ('Momentum', 'Mean Reversion', 'ARIMA')
+ARIMA_REFIT_EVERY = 20
+ARIMA_ORDERS = [(p, 0, q) for p in range(3) for q in range(3)]
+
+
+def decide(rate, choice, period, order):
+    if choice == 'Random':
+        return random.choice(['buy', 'sell', 'wait'])
+    if choice == 'Momentum':
+        if len(rate) < period:
+            return 'wait'
+        if sum(rate[-period:]) / period > 0:
+            return 'buy'
+        return 'sell'
+    if choice == 'Mean Reversion':
+        if len(rate) < period + 1:
             return 'wait'
-    prices = get_stock_data(symbol, days_away)['close']
+        avg_rate = np.mean(rate[-(period+1):-1])
+        if avg_rate > rate[-1]:
+            return 'buy'
+        return 'sell'
+    if choice == 'ARIMA':
+        if len(rate) > 30:
+            model = ARIMA(rate, order=order).fit()
+            prediction = model.forecast(steps=1)
+            if prediction > 0.002:
+                return 'buy'
+            if prediction < -0.002:
+                return 'sell'
+        return 'wait'
+
+
+def get_returns(prices):
     returns = prices.pct_change().dropna()
-    returns = returns[~returns.index.duplicated(keep='first')]
+    return returns[~returns.index.duplicated(keep='first')]
+
+
+def signal_matrix(choice, periods, rate):
+    # Same rules as decide(), for every period and day at once: row k holds the
+    # signals for periods[k], and signal i only sees rate[:i].
+    # 1 = buy, -1 = sell, 0 = wait
+    rate = np.asarray(rate, dtype=float)
+    n = len(rate)
+    periods = list(periods)
+    signals = np.zeros((len(periods), n), dtype=np.int8)
+    if choice == 'Momentum':
+        # window_sum[i] = sum(rate[i-p:i]) for the current p, grown one period at a time.
+        # Adding the newest return last keeps the left-to-right order of sum(), so the
+        # sign matches decide() exactly.
+        window_sum = np.zeros(n + 1)
+        for p in range(1, max(periods, default=0) + 1):
+            window_sum[1:] = window_sum[:-1] + rate
+            for k in [k for k, period in enumerate(periods) if period == p and n > p]:
+                signals[k, p:] = np.where(window_sum[p:n] / p > 0, 1, -1)
+    elif choice == 'Mean Reversion':
+        for k, p in enumerate(periods):
+            if n > p + 1:
+                avg_rate = sliding_window_view(rate[:n - 2], p).mean(axis=1)
+                signals[k, p + 1:] = np.where(avg_rate > rate[p:n - 1], 1, -1)
+    return signals
+
+
+def panel_signals(choice, period, rates):
+    # signal_matrix() for one period over a days x symbols matrix of returns, every
+    # symbol at once. A window with a missing return (not listed yet, suspended) waits.
+    rates = np.asarray(rates, dtype=float)
+    n = len(rates)
+    signals = np.zeros(rates.shape, dtype=np.int8)
+    if choice == 'Momentum' and n > period:
+        # oldest return first, the same order as sum() in decide()
+        window_sum = np.zeros((n - period,) + rates.shape[1:])
+        for k in range(period):
+            window_sum += rates[k:n - period + k]
+        signals[period:] = np.where(np.isnan(window_sum), 0, np.where(window_sum / period > 0, 1, -1))
+    elif choice == 'Mean Reversion' and n > period + 1:
+        avg_rate = sliding_window_view(rates[:n - 2], period, axis=0).mean(axis=-1)
+        latest = rates[period:n - 1]
+        signals[period + 1:] = np.where(np.isnan(avg_rate) | np.isnan(latest), 0, np.where(avg_rate > latest, 1, -1))
+    elif choice not in ('Momentum', 'Mean Reversion'):
+        raise ValueError(f'{choice} has no cross-sectional signals')
+    return signals
+
+
+def arima_forecasts(rate, order, refit_every=ARIMA_REFIT_EVERY, window=None):
+    # One-step forecasts of rate[i] from rate[:i] with the 'ARIMA' model of decide().
+    # The model is only refit every `refit_every` days (warm-started from the last fit,
+    # on the last `window` returns if given). The days in between keep those parameters
+    # and run the state-space filter over the new returns once through extend().
+    rate = np.asarray(rate, dtype=float)
+    n = len(rate)
+    forecasts = np.full(n, np.nan)
+    params = None
+    for start in range(31, n, refit_every):
+        stop = min(start + refit_every, n)
+        history = rate[:start] if window is None else rate[max(0, start - window):start]
+        res = ARIMA(history, order=order).fit(start_params=params)
+        params = res.params
+        if stop - start > 1:
+            res = res.extend(rate[start:stop - 1])
+            forecasts[start:stop] = np.append(res.predict(), res.forecast(1))
+        else:
+            forecasts[start] = res.forecast(1)[0]
+    return forecasts
+
+
+def arima_signals(rate, order, refit_every=ARIMA_REFIT_EVERY, window=None):
+    forecasts = arima_forecasts(rate, order, refit_every, window)
+    return np.select([forecasts > 0.002, forecasts < -0.002], [1, -1], 0).astype(np.int8)
 
-    events_list = []
+
+def strategy_signals(choice, period, rate, order=None):
+    if choice == 'ARIMA':
+        return arima_signals(rate, order)
+    return signal_matrix(choice, [period], rate)[0]
+
+
+def aligned_prices(returns, prices):
+    # the price on each return's date, first one wins on duplicated dates like prices.loc
+    return prices[~prices.index.duplicated(keep='first')].reindex(returns.index).to_numpy()
+
+
+def settlement_unlock(dates, costs=DEFAULT_COSTS):
+    return cost_model(costs).settlement_unlock(dates)
+
+
+def run_signals(signals, dates, prices, amt, position_sizing, costs=DEFAULT_COSTS):
+    # prices: aligned_prices() for the returns the signals were computed on
+    costs = cost_model(costs)
+    n = len(signals)
+    unlock = costs.settlement_unlock(dates)
+    can_buy, can_sell = costs.fillable(prices, dates)
+    positions = np.arange(n)
+    is_buy = (signals == 1) & can_buy
+    # next_buy[i] / next_sell[i]: first day >= i with a signal that can fill, n if there is none
+    next_buy = np.append(np.minimum.accumulate(np.where(is_buy, positions, n)[::-1])[::-1], n)
+    next_sell = np.append(np.minimum.accumulate(np.where((signals == -1) & can_sell, positions, n)[::-1])[::-1], n)
+
+    trades = []
+    buy_price = None
+    total_shares_held = 0
+    buying_price = []
+    i = 0
+    while i < n:
+        # Sell signals only matter while holding shares; a buy before then wins
+        stop = next_sell[i] if total_shares_held > 0 else n
+        limit = amt*position_sizing
+        # the cheapest price a whole lot can be bought at, fee included
+        lot_cost = (1 + costs.buy_rate(limit)) * costs.lot_size
+        j = next_buy[i]
+        if j < stop and not prices[j]*lot_cost < limit:
+            affordable = np.flatnonzero(is_buy[j:stop] & (prices[j:stop]*lot_cost < limit))
+            j = j + affordable[0] if len(affordable) else stop
+        if j < stop:
+            buy_price = prices[j]
+            buy_amount = costs.buy_quantity(limit, buy_price)
+            amt -= buy_price*buy_amount*(1 + costs.buy_rate(limit))
+            buying_price.append(buy_price)
+            trades.append((BUY, dates[j], buy_price, buy_amount, np.nan, amt))
+            total_shares_held += buy_amount
+        elif stop < n:
+            j = stop
+            buy_price = sum(buying_price) / len(buying_price) if len(buying_price) > 0 else buy_price
+            buying_price.clear()
+            sell_amount = total_shares_held
+            sell_price = prices[j]
+            amt += sell_price*sell_amount*(1 - costs.sell_rate(sell_price*sell_amount))
+            ret = (sell_price - buy_price) / buy_price
+            trades.append((SELL, dates[j], sell_price, sell_amount, ret, amt))
+            total_shares_held -= sell_amount
+        else:
+            break
+        i = unlock[j]
+    return TradeLedger.from_rows(trades), amt, total_shares_held
+
+
+def run_decisions(choice, period, order, returns, prices, amt, position_sizing, verbose=False, costs=DEFAULT_COSTS):
+    costs = cost_model(costs)
+    trades = []
     buy_price = None
-    init_amt = amt
     total_shares_held = 0
     buying_price = []
     rate = []
-    last_buy = 0
-    last_sell = 0
-    for date, r in tqdm(returns.items(), total=len(returns)):
+    values = aligned_prices(returns, prices)
+    unlock = costs.settlement_unlock(returns.index)
+    can_buy, can_sell = costs.fillable(values, returns.index)
+    next_trade = 0
+    bars = zip(returns.index, returns.to_numpy(), values)
+    for i, (date, r, current_price) in enumerate(tqdm(bars, total=len(returns), disable=not verbose)):
         action = decide(rate, choice, period, order)
-        if last_buy > 0:
-            last_buy -= 1
-            action = 'wait'
-        if last_sell > 0:
-            last_sell -= 1
+        if i < next_trade:
             action = 'wait'
-        current_price = prices.loc[date]
-        if isinstance(current_price, pd.Series):
-            current_price = prices.loc[date].iloc[0]
         rate.append(r)
         if action == 'wait':
             if verbose:
                 print(f'Waited with {total_shares_held} shares')
 
-        if action == 'sell' and total_shares_held > 0:
+        if action == 'sell' and total_shares_held > 0 and can_sell[i]:
             buy_price = sum(buying_price) / len(buying_price) if len(buying_price) > 0 else buy_price
             buying_price.clear()
             sell_amount = total_shares_held  # $random.randint(1, total_shares_held) if total_shares_held > 1 else 1
             sell_price = current_price
-            amt += sell_price*sell_amount*0.9965
+            amt += sell_price*sell_amount*(1 - costs.sell_rate(sell_price*sell_amount))
             ret = (sell_price - buy_price) / buy_price
-            events_list.append(('s', date, sell_price, ret, sell_amount, amt))
+            trades.append((SELL, date, sell_price, sell_amount, ret, amt))
             total_shares_held -= sell_amount
-            last_sell = 2
+            next_trade = unlock[i]
 
             if verbose:
                 print(f'Sold {sell_amount} stocks at %s. Current asset: {amt}' % sell_price)
                 print(f'Actual Return: %s, {total_shares_held} shares left' % (round(ret * 100, 4)))
                 print('=======================================')
 
-        elif action == 'buy' and amt*position_sizing > current_price:
+        elif action == 'buy' and can_buy[i] and costs.buy_quantity(amt*position_sizing, current_price) > 0:
             buy_price = current_price
-            buy_amount = int(amt*position_sizing/buy_price)
-            amt -= buy_price*buy_amount
+            buy_amount = costs.buy_quantity(amt*position_sizing, buy_price)
+            amt -= buy_price*buy_amount*(1 + costs.buy_rate(amt*position_sizing))
             buying_price.append(buy_price)
-            events_list.append(('b', date, buy_price, buy_amount))
+            trades.append((BUY, date, buy_price, buy_amount, np.nan, amt))
             total_shares_held += buy_amount
-            last_buy = 2
+            next_trade = unlock[i]
             if verbose:
                 print(f'Bought {buy_amount} stocks at {buy_price}, {amt} remaining')
+    return TradeLedger.from_rows(trades), amt, total_shares_held
+
+
+def backtest(choice, period, prices, amt, order, position_sizing, verbose=False, engine='auto', costs=DEFAULT_COSTS):
+    # intraday closes are stored as float32, cash is not
+    prices = prices.astype(float)
+    returns = get_returns(prices)
+    if engine == 'auto':
+        engine = 'vectorized' if choice in VECTORIZED_CHOICES and not verbose else 'loop'
+    if engine == 'vectorized':
+        signals = strategy_signals(choice, period, returns.to_numpy(), order)
+        ledger, amt, total_shares_held = run_signals(signals, returns.index, aligned_prices(returns, prices), amt, position_sizing, costs)
+    else:
+        ledger, amt, total_shares_held = run_decisions(choice, period, order, returns, prices, amt, position_sizing, verbose, costs)
 
     if verbose:
         print('Total Amount: $%s' % round(amt, 2))
 
+    total_asset = round((amt + total_shares_held*prices.iloc[-1])/1000000, 2)
+    stats = analyze(ledger, amt, total_asset)
+    return ledger, amt, total_shares_held, stats
+
+
+def simulate_trading(choice, period, symbol, days_away, amt, order, position_sizing, verbose=False, plot=True, engine='auto', resolution='1D', costs=DEFAULT_COSTS):
+    prices = get_stock_data(symbol, days_away, resolution)['close'].astype(float)
+    init_amt = amt
+    ledger, amt, total_shares_held, stats = backtest(choice, period, prices, amt, order, position_sizing, verbose, engine, costs)
+
     total_return = round(100*((amt + total_shares_held*prices.iloc[-1]) / init_amt - 1), 2)
     total_return = str(total_return) + '%'
     total_asset = round((amt + total_shares_held*prices.iloc[-1])/1000000, 2)
-    stats = analyze(events_list, amt, total_asset)
     # graph
     if plot:
         fig, ax = plt.subplots(figsize=(10, 4))
@@ -194,33 +393,22 @@ def simulate_trading(choice, period, symbol, days_away, amt, order, position_siz
         for tick in y_ticks:
             ax.axhline(tick, color='black', linestyle='-', linewidth=0.8, alpha=0.2)
         buy_index = 0
-        buy_amounts = [event[3] for event in events_list]
-        date_proportion_dict = {}
-        for event in events_list:
-            date = event[1]
-            buy_amount = event[3]
-            proportion = buy_amount / (max(buy_amounts)*1)
-            date_proportion_dict[date] = proportion
-
-        for idx, event in enumerate(events_list):
-            if event[0] == 'b':
-                if idx == 0:
+        buys = ledger.side == BUY
+        max_buy = ledger.qty[buys].max() if buys.any() else 1
+        for idx, trade in enumerate(ledger.trades):
+            date = pd.Timestamp(trade['date'])
+            if trade['side'] == BUY:
+                if idx == 0 or ledger.side[idx - 1] == SELL:
                     buy_index = idx
-                    ax.axvline(event[1], color='k', linestyle='--', alpha=0.4)
-                    continue
-                if events_list[idx - 1][0] == 's':
-                    buy_index = idx
-                    ax.axvline(event[1], color='k', linestyle='--', alpha=0.4)
+                    ax.axvline(date, color='k', linestyle='--', alpha=0.4)
                 else:
-                    proportion = date_proportion_dict[event[1]]
-                    ax.axvline(event[1], color='white', linestyle='-', alpha=0.15, ymin=0, ymax=proportion)
-
-            if event[0] == 's':
-                color = 'green' if event[3] > 0 else ('yellow' if event[3] == 0 else 'red')
+                    ax.axvline(date, color='white', linestyle='-', alpha=0.15, ymin=0, ymax=trade['qty'] / max_buy)
+            else:
+                color = 'green' if trade['ret'] > 0 else ('yellow' if trade['ret'] == 0 else 'red')
                 ax.fill_betweenx(range(int(prices.min()*.5), int(prices.max()*1.5)),
-                                 event[1], events_list[buy_index][1],
+                                 date, pd.Timestamp(ledger.date[buy_index]),
                                  color=color, alpha=0.2)
-                ax.axvline(event[1], color='k', linestyle='--', alpha=0.4)
+                ax.axvline(date, color='k', linestyle='--', alpha=0.4)
         ax.set_title("%s(%s)\nTotal Asset: %sM, Total Return: %s\nShares Left: %s" %(choice, period if period is not None else order, total_asset, total_return, total_shares_held), fontsize=20)
         ax.set_ylim(prices.min() * 0.95, prices.max() * 1.05)
 
@@ -229,29 +417,222 @@ def simulate_trading(choice, period, symbol, days_away, amt, order, position_siz
     return stats
 
 
-def optimize_choice(choice, symbol, days_away, position_sizing):
-    all_returns = {}
-    for period in range(1, 31, 1):
-        stats = simulate_trading(choice, period, symbol, days_away, 100_000_000, 0, position_sizing, verbose=False, plot=False)
-        all_returns[period] = stats['Return']
-    best_period = max(all_returns, key=all_returns.get)
+def sweep_choice(choice, symbol, days_away, periods=range(1, 31), position_sizings=(1,), costs=(DEFAULT_COSTS,), amt=100_000_000, orders=ARIMA_ORDERS, resolution='1D'):
+    # One fetch and one signal matrix for every period (every order for ARIMA), then
+    # each (period, position sizing, cost model) combination is replayed on trade days only.
+    # costs: CostModels, COST_MODELS names or flat sell costs.
+    # Returns the analyze() stats for every combination, indexed by period, position
+    # sizing and cost model name.
+    prices = get_stock_data(symbol, days_away, resolution)['close'].astype(float)
+    returns = get_returns(prices)
+    values = aligned_prices(returns, prices)
+    if choice == 'ARIMA':
+        periods = list(orders)
+        signals = [arima_signals(returns.to_numpy(), order) for order in periods]
+    else:
+        signals = signal_matrix(choice, periods, returns.to_numpy())
+    models = [cost_model(model) for model in costs]
+    surface = {}
+    for period, period_signals in zip(periods, signals):
+        for position_sizing in position_sizings:
+            for model in models:
+                ledger, cash, shares = run_signals(period_signals, returns.index, values, amt, position_sizing, model)
+                total_asset = round((cash + shares*prices.iloc[-1])/1000000, 2)
+                surface[(period, position_sizing, model.name)] = analyze(ledger, cash, total_asset)
+    surface = pd.DataFrame.from_dict(surface, orient='index')
+    surface.index = surface.index.set_names(['order' if choice == 'ARIMA' else 'period', 'position_sizing', 'costs'])
+    return surface
+
+
+def optimize_choice(choice, symbol, days_away, position_sizing, resolution='1D', costs=DEFAULT_COSTS):
+    surface = sweep_choice(choice, symbol, days_away, position_sizings=(position_sizing,), costs=(costs,), resolution=resolution)
+    best_period = surface['Return'].idxmax()[0]
     return best_period
 
 
-def test_market(choice, period, days_away):
-    results = {}
-    params = {
-                "exchangeName": "HOSE,HNX",
-                'marketCap': (1000, 99999999999),
-                }
-    tickers = stock_screening_insights(params, size=1700)['ticker']
-    for ticker in tickers:
+def fold_return(signals, dates, prices, amt, position_sizing, costs):
+    # analyze()'s 'Return', without building the stats nobody reads here
+    _, cash, shares = run_signals(signals, dates, prices, amt, position_sizing, costs)
+    return round((cash + shares*prices[-1])/1000000, 2)/100 - 1
+
+
+def evaluate_fold(signals, dates, prices, periods, train, test, amt, position_sizing, costs):
+    # Runs in a worker process: picks the best period on the train slice, scores it on the test slice
+    in_sample = [fold_return(period_signals[train], dates[train], prices[train], amt, position_sizing, costs)
+                 for period_signals in signals]
+    best = int(np.argmax(in_sample))
+    out_of_sample = fold_return(signals[best][test], dates[test], prices[test], amt, position_sizing, costs)
+    return {'train_start': dates[train][0], 'train_end': dates[train][-1],
+            'test_start': dates[test][0], 'test_end': dates[test][-1],
+            'period': periods[best], 'In-sample Return': in_sample[best], 'Out-of-sample Return': out_of_sample}
+
+
+def walk_forward(choice, symbol, days_away, folds=10, position_sizing=1, periods=range(1, 31), orders=ARIMA_ORDERS,
+                 amt=100_000_000, costs=DEFAULT_COSTS, resolution='1D', workers=1):
+    # The window is cut into folds + 1 equal blocks; fold k picks the period on block k and
+    # trades it on block k + 1. Signals for every period are computed once on the whole
+    # series (signal i only sees rate[:i]), so a test block still gets its lookback from
+    # the bars before it. workers other than 1 run the folds on the process pool, which
+    # only pays off for long series: a fold is a few milliseconds of work.
+    # Returns one row per fold and the compounded out-of-sample return.
+    prices = get_stock_data(symbol, days_away, resolution)['close'].astype(float)
+    returns = get_returns(prices)
+    values = aligned_prices(returns, prices)
+    dates = returns.index.to_numpy()
+    if choice == 'ARIMA':
+        periods = list(orders)
+        signals = np.array([arima_signals(returns.to_numpy(), order) for order in periods])
+    else:
+        periods = list(periods)
+        signals = signal_matrix(choice, periods, returns.to_numpy())
+    edges = np.linspace(0, len(returns), folds + 2).astype(int)
+    if np.diff(edges).min() < 2:
+        raise ValueError(f'{len(returns)} bars are too few for {folds} folds')
+    splits = [(slice(edges[k], edges[k + 1]), slice(edges[k + 1], edges[k + 2])) for k in range(folds)]
+    args = (signals, dates, values, periods)
+    if workers == 1:
+        rows = [evaluate_fold(*args, train, test, amt, position_sizing, costs) for train, test in splits]
+    else:
+        workers = workers or os.cpu_count() or 1
         try:
-            stats = simulate_trading(choice, period, ticker, days_away, 100_000_000, 0, 1, verbose=False, plot=False)
-            results[ticker] = stats['Return']
-        except Exception:
-            results[ticker] = None
-    return results
+            futures = [process_pool(workers).submit(evaluate_fold, *args, train, test, amt, position_sizing, costs)
+                       for train, test in splits]
+            rows = [future.result() for future in futures]
+        except BrokenProcessPool:
+            _process_pools.pop(workers, None)
+            raise
+    table = pd.DataFrame(rows)
+    table = table.rename(columns={'period': 'order' if choice == 'ARIMA' else 'period'})
+    return table, np.prod(1 + table['Out-of-sample Return']) - 1
+
+
+def market_stats(choice, period, order, prices, position_sizing=1):
+    # Runs in a worker process: prices are fetched by the caller. analyze() stats plus
+    # the trade count and the first and last bar they were computed on.
+    ledger, _, _, stats = backtest(choice, period, prices, 100_000_000, order, position_sizing)
+    return {**stats, 'Trades': len(ledger), 'start': prices.index[0], 'asOf': prices.index[-1]}
+
+
+def market_return(choice, period, order, prices, position_sizing=1):
+    return market_stats(choice, period, order, prices, position_sizing)['Return']
+
+
+_process_pools = {}
+
+
+def worker_ready():
+    return os.getpid()
+
+
+def process_pool(workers):
+    # Kept for the life of the server, so only the first sweep waits for workers to spawn
+    pool = _process_pools.get(workers)
+    if pool is None:
+        pool = _process_pools[workers] = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+    return pool
+
+
+def market_tickers():
+    return screener(min_market_cap=1000)['ticker'].tolist()
+
+
+def test_market(choice, period, days_away, workers=None, fetch_workers=8, timeout=None, order=0, tickers=None, position_sizing=1, stats=False):
+    # Yields (ticker, return or None, error reason or None) as each ticker finishes,
+    # or market_stats() instead of the return with stats=True.
+    # Fetches run on a thread pool and simulations on a process pool. Neither pool is
+    # fed more jobs than it has workers, and `timeout` (seconds) counts from when a
+    # ticker's job is first seen running. A job that times out keeps its worker busy
+    # until it really ends, so it still counts against the pool and the next ticker
+    # isn't queued (and timed) behind it. workers=1 runs everything in this process.
+    # Closing the generator stops feeding jobs; ones already running finish in the background.
+    if tickers is None:
+        tickers = market_tickers()
+    job = market_stats if stats else market_return
+
+    if workers == 1:
+        for ticker in tickers:
+            try:
+                prices = get_stock_data(ticker, days_away)
+                if len(prices) == 0:
+                    yield ticker, None, 'No price data'
+                    continue
+                value = job(choice, period, order, prices['close'], position_sizing)
+            except Exception as e:
+                yield ticker, None, f'{type(e).__name__}: {e}'
+                continue
+            yield ticker, value, None
+        return
+
+    workers = workers or os.cpu_count() or 1
+    pending_tickers = deque(tickers)
+    fetched = deque()
+    fetching = {}
+    simulating = {}
+    abandoned_fetches = set()
+    abandoned_simulations = set()
+    io_pool = ThreadPoolExecutor(fetch_workers)
+    cpu_pool = process_pool(workers)
+    try:
+        if timeout is not None:
+            # spawning workers and importing this module shouldn't count against the first tickers
+            wait([cpu_pool.submit(worker_ready) for _ in range(workers)])
+        poll = 1 if timeout is None else min(1, timeout / 10)
+        while pending_tickers or fetched or fetching or simulating:
+            while pending_tickers and len(fetching) + len(abandoned_fetches) < fetch_workers:
+                ticker = pending_tickers.popleft()
+                fetching[io_pool.submit(get_stock_data, ticker, days_away)] = [ticker, None]
+            while fetched and len(simulating) + len(abandoned_simulations) < workers:
+                ticker, prices = fetched.popleft()
+                future = cpu_pool.submit(job, choice, period, order, prices, position_sizing)
+                simulating[future] = [ticker, None]
+
+            finished = []
+            done, _ = wait([*fetching, *simulating, *abandoned_fetches, *abandoned_simulations],
+                           timeout=poll, return_when=FIRST_COMPLETED)
+            abandoned_fetches -= done
+            abandoned_simulations -= done
+            for future in done:
+                if future not in fetching and future not in simulating:
+                    continue
+                if future in fetching:
+                    ticker, _ = fetching.pop(future)
+                    try:
+                        prices = future.result()
+                    except Exception as e:
+                        finished.append((ticker, None, f'{type(e).__name__}: {e}'))
+                        continue
+                    if len(prices) == 0:
+                        finished.append((ticker, None, 'No price data'))
+                    else:
+                        fetched.append((ticker, prices['close']))
+                else:
+                    ticker, _ = simulating.pop(future)
+                    try:
+                        finished.append((ticker, future.result(), None))
+                    except Exception as e:
+                        finished.append((ticker, None, f'{type(e).__name__}: {e}'))
+
+            if timeout is not None:
+                now = time.monotonic()
+                for jobs, abandoned in ((fetching, abandoned_fetches), (simulating, abandoned_simulations)):
+                    for future, started in list(jobs.items()):
+                        if started[1] is None:
+                            if future.running():
+                                started[1] = now
+                        elif now - started[1] > timeout:
+                            if not future.cancel():
+                                abandoned.add(future)
+                            del jobs[future]
+                            finished.append((started[0], None, f'Timed out after {timeout}s'))
+            yield from finished
+    except BrokenProcessPool:
+        _process_pools.pop(workers, None)
+        raise
+    finally:
+        # don't block on jobs that timed out or were cancelled
+        io_pool.shutdown(wait=False, cancel_futures=True)
+        for future in simulating:
+            future.cancel()
 
 
 def split_results(results):
@@ -269,6 +650,6 @@ def split_results(results):
     return wins, losses
 
 
-def simulate_buy_hold(symbol, days_away):
-    prices = get_stock_data(symbol, days_away)['close']
+def simulate_buy_hold(symbol, days_away, resolution='1D'):
+    prices = get_stock_data(symbol, days_away, resolution)['close'].astype(float)
     return prices.iloc[-1] / prices.iloc[0] - 1
@@ -0,0 +1,132 @@
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from vnstock import stock_historical_data
+
+# Local OHLCV store: one Parquet file per symbol and resolution, topped up from the
+# network only for the days after the last stored bar.
+DATA_DIR = os.environ.get('FINETIZE_DATA_DIR', os.path.join(os.path.expanduser('~'), '.finetize'))
+STALE_AFTER = timedelta(minutes=15)
+# resolution: (vnstock resolution, longest window fetched in one request or None for no limit)
+RESOLUTIONS = {
+    '1D': ('1D', None),
+    '1H': ('1H', timedelta(days=90)),
+    '15m': ('15', timedelta(days=30)),
+    '1m': ('1', timedelta(days=7)),
+}
+# Intraday files are stored with 32-bit columns; a year of minute bars is ~60k rows per symbol
+COMPACT_DTYPES = {'open': 'float32', 'high': 'float32', 'low': 'float32', 'close': 'float32', 'volume': 'int32'}
+
+
+def tcbs_fetcher(symbol, start_date, end_date, resolution='1D'):
+    return stock_historical_data(symbol, start_date, end_date, RESOLUTIONS[resolution][0],
+                                 type='stock' if len(symbol) == 3 else 'index', source='TCBS')
+
+
+_fetcher = tcbs_fetcher
+
+
+def set_fetcher(fetcher):
+    # fetcher(symbol, 'YYYY-MM-DD', 'YYYY-MM-DD', resolution) -> DataFrame with a 'time' column, like vnstock
+    global _fetcher
+    _fetcher = fetcher
+
+
+def price_path(symbol, resolution='1D'):
+    name = symbol.upper() if resolution == '1D' else f'{symbol.upper()}-{resolution}'
+    return os.path.join(DATA_DIR, 'prices', f'{name}.parquet')
+
+
+def read_prices(symbol, resolution='1D'):
+    path = price_path(symbol, resolution)
+    if not os.path.exists(path):
+        return None, None, None
+    table = pq.read_table(path, memory_map=True)
+    meta = json.loads(table.schema.metadata[b'finetize'])
+    return table.to_pandas(), pd.Timestamp(meta['covered_from']), pd.Timestamp(meta['checked_at'])
+
+
+def write_atomic(path, write):
+    # write(temp path) to a file of its own next to path, then rename it over path, so
+    # a concurrent reader never sees a half-written file and concurrent writers never
+    # share a temp file
+    fd, temp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    os.close(fd)
+    try:
+        write(temp)
+        os.replace(temp, path)
+    except BaseException:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+
+
+def write_prices(symbol, df, covered_from, checked_at, resolution='1D'):
+    path = price_path(symbol, resolution)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    table = pa.Table.from_pandas(df)
+    meta = {'covered_from': covered_from.isoformat(), 'checked_at': checked_at.isoformat()}
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), b'finetize': json.dumps(meta)})
+    write_atomic(path, lambda temp: pq.write_table(table, temp))
+
+
+def compact_prices(df):
+    return df.astype({column: dtype for column, dtype in COMPACT_DTYPES.items() if column in df})
+
+
+def fetch_prices(symbol, start_date, end_date, fetcher=None, resolution='1D'):
+    # Intraday windows are fetched in consecutive chunks the source will serve in one request
+    chunk = RESOLUTIONS[resolution][1]
+    starts = [start_date] if chunk is None else pd.date_range(start_date.normalize(), end_date, freq=chunk)
+    frames = []
+    for i, start in enumerate(starts):
+        end = end_date if i == len(starts) - 1 else starts[i + 1] - timedelta(days=1)
+        if resolution == '1D':
+            df = (fetcher or _fetcher)(symbol, start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'))
+        else:
+            df = (fetcher or _fetcher)(symbol, start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'), resolution)
+        if df is not None and not df.empty:
+            frames.append(df)
+    if not frames:
+        return None
+    df = pd.concat(frames).set_index('time')
+    df.index = pd.to_datetime(df.index)
+    return df
+
+
+def load_prices(symbol, start_date, end_date, fetcher=None, resolution='1D'):
+    start = pd.Timestamp(start_date).normalize()
+    end = pd.Timestamp(end_date)
+    now = pd.Timestamp(datetime.today())
+    df, covered_from, checked_at = read_prices(symbol, resolution)
+    changed = False
+    if df is None:
+        df = fetch_prices(symbol, start, end, fetcher, resolution)
+        if df is None:
+            return None
+        covered_from, checked_at, changed = start, now, True
+    elif start < covered_from:
+        # a longer window than we have stored: only fetch the missing head
+        head = fetch_prices(symbol, start, covered_from, fetcher, resolution)
+        if head is not None:
+            df = pd.concat([head, df])
+        covered_from, changed = start, True
+    if checked_at < min(end, now - STALE_AFTER):
+        # top up from the last stored bar, which may have been a partial intraday bar
+        try:
+            tail = fetch_prices(symbol, df.index[-1], end, fetcher, resolution)
+            if tail is not None:
+                df = pd.concat([df, tail])
+            checked_at, changed = now, True
+        except Exception:
+            print(f"Error topping up {symbol}, serving stored data.")
+    if changed:
+        df = df[~df.index.duplicated(keep='last')].sort_index()
+        if resolution != '1D':
+            df = compact_prices(df)
+        write_prices(symbol, df, covered_from, checked_at, resolution)
+    return df[(df.index >= start) & (df.index <= end)]
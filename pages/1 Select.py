@@ -1,19 +1,18 @@
 import streamlit as st
-from vnstock import stock_screening_insights
+from functions.screener import screener, screener_as_of, SNAPSHOT_TTL
 from functions.plots import get_stock_data
-from functions.select import fundamental_selections, technical_selections, filter_stock, compare_stocks
+from functions.indicators import INDICATOR_COLUMNS
+from functions.select import fundamental_selections, technical_selections, filter_stock, compare_stocks, market_table
 st.set_page_config(layout="wide",
                    page_title='Stock Filter')
 
 
-@st.cache_data()
+MIN_MARKET_CAP = 100
+
+
+@st.cache_data(ttl=SNAPSHOT_TTL)
 def get_df():
-    default_params = {
-        'exchangeName': 'HOSE,HNX',
-        'marketCap': (100, 99999999999),
-    }
-    df = stock_screening_insights(default_params, size=1700, drop_lang='vi')
-    return df
+    return screener(min_market_cap=MIN_MARKET_CAP), screener_as_of()
 
 
 @st.cache_data()
@@ -29,7 +28,7 @@ def get_market_info(df):
 @st.cache_data(show_spinner='Loading Comparison Table')
 def generate_dataframe(df, symbol_list, total_market_cap):
     st.dataframe(
-        compare_stocks(df, symbol_list),
+        compare_stocks(df, symbol_list, market_table(MIN_MARKET_CAP)),
         column_config={
             "ticker": st.column_config.TextColumn(
                 "Symbol",
@@ -37,7 +36,7 @@ def generate_dataframe(df, symbol_list, total_market_cap):
             "price_change": st.column_config.LineChartColumn(
                 "Price Change",
                 width="small",
-                help="Change in price every minute in the last 6 Months",
+                help="Change in daily closing price over the last 6 months",
                 y_min=-1,
                 y_max=1
             ),
@@ -77,12 +76,12 @@ def generate_dataframe(df, symbol_list, total_market_cap):
         )
 
 
-df = get_df()
+df, as_of = get_df()
 symbols, industries, total_market_cap = get_market_info(df)
 tab1, tab2 = st.tabs(['Filter', 'Compare'])
 with tab1:
     st.title('Stock Filter', anchor=False)
-    st.caption('Based on `HOSE & HNX`, of symbols with a market cap of more than `1000`')
+    st.caption(f'Based on `HOSE & HNX`, of symbols with a market cap of more than `1000` (as of `{as_of:%Y-%m-%d %H:%M}`)')
     col1, col2 = st.columns(2)
     with col1:
         with st.popover('Select Metrics', use_container_width=True):
@@ -102,6 +101,12 @@ with tab1:
                 st.write('')
                 st.write('')
                 params['macd'] = st.checkbox('MACD < 0 and Increasing')
+            indicators = st.multiselect('Indicators:', INDICATOR_COLUMNS, placeholder='More indicators')
+            indicator_ranges = {}
+            for name in indicators:
+                low_col, high_col = st.columns(2)
+                indicator_ranges[name] = (low_col.number_input(f'{name} >=', value=None, key=f'{name}_low'),
+                                          high_col.number_input(f'{name} <=', value=None, key=f'{name}_high'))
 
     with col2:
         col2a, col2b = st.columns(2)
@@ -115,7 +120,8 @@ with tab1:
             filter = st.button('Filter')
 
     if filter:
-        tickers = filter_stock(df, params, industry)
+        with st.spinner('Filtering'):
+            tickers = filter_stock(df, params, industry, indicator_ranges)
         st.dataframe(tickers, hide_index=True)
 with tab2:
     if "symbol_list" not in st.session_state:
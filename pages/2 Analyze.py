@@ -1,44 +1,50 @@
 import streamlit as st
 from vnstock import company_profile
-from functions.plots import generate_data_plot, generate_acf_plots, generate_histogram_plot, get_stock_data, generate_metrics, generate_scatter_plot, get_basic_data
+from functions.plots import generate_data_plot, generate_acf_plots, generate_histogram_plot, generate_metrics, generate_scatter_plot, get_basic_data
+from functions.analytics import symbol_analytics
+from functions.store import RESOLUTIONS
 from functions.evaluate import symbol_eval
-import pandas as pd
+from functions.simulation import kelly_sizing, lockout_bars
 import traceback
 st.set_page_config(layout="wide",
                    page_title='Stock Analysis')
 
 
-@st.cache_data(show_spinner="Retrieving stocks's data")
-def retrieve_data(symbol, days_away):
+def retrieve_data(symbol, days_away, resolution):
+    # Shared across sessions and keyed on the last bar, see functions/analytics.py
     try:
-        df = get_stock_data(symbol, days_away=days_away).dropna()
-        returns = df['close'].pct_change()
+        return symbol_analytics(symbol, days_away, resolution)
     except Exception:
         st.error('Invalid Stock Symbol')
-        return
-    return df, returns
+        st.stop()
 
 
+# The figures are cached on analytics.key; the analytics object itself is not hashed
 @st.cache_data(show_spinner='Generating Plots')
-def graph_price_plot(df, data_selection='Price'):
-    fig = generate_data_plot(df, data_selection)
+def graph_price_plot(key, _analytics, data_selection='Price'):
+    fig = generate_data_plot(_analytics, data_selection)
     return fig
 
 
 @st.cache_data(show_spinner='Generating Plots')
-def graph_col1_plots(symbol, days_away):
-    df, returns = retrieve_data(symbol, days_away)
-    plot_histogram = generate_histogram_plot(df)
-    plot_acf = generate_acf_plots(returns, plot_pacf=False)
-    plot_pacf = generate_acf_plots(returns, plot_pacf=True)
+def graph_col1_plots(key, _analytics):
+    plot_histogram = generate_histogram_plot(_analytics)
+    plot_acf = generate_acf_plots(_analytics, plot_pacf=False)
+    plot_pacf = generate_acf_plots(_analytics, plot_pacf=True)
     # plot_acf_pacf = generate_acf_pacf_plots(df)
-    summary_data = {'Statistic': ['Mean', 'Median', 'Min', 'Max'],
-                    'Return': [returns.mean(), returns.median(), returns.min(), returns.max()]}
-    summary_df = pd.DataFrame(summary_data)
-    plot_scatter = generate_scatter_plot(df, days_away)
+    summary_df = _analytics.summary()
+    plot_scatter = generate_scatter_plot(_analytics)
     return plot_histogram, plot_acf, plot_pacf, summary_df, plot_scatter
 
 
+@st.cache_data(show_spinner='Sizing Positions')
+def size_position(key, _analytics):
+    # a position is held at least until the T+2 lockout ends, counted in sessions so
+    # intraday bars hold it for as many bars as those sessions have
+    prices = _analytics.df['close']
+    return kelly_sizing(prices, horizon=lockout_bars(prices.index), seed=0)
+
+
 @st.cache_data(show_spinner='Loading Financial Metrics')
 def calculate_financial_metrics(symbol):
     # metric_list = ['priceToEarning', 'priceToBook', 'roe', 'roa', 'earningPerShare', 'bookValuePerShare', 'interestMargin', 'badDebtPercentage']
@@ -74,21 +80,29 @@ with tab1:
             if 'days_away' not in st.session_state:
                 st.session_state['days_away'] = 365
             days_away = st.number_input('Enter Days Away:', min_value=4, value=st.session_state['days_away'])
+        with subcol3:
+            if 'resolution' not in st.session_state:
+                st.session_state['resolution'] = '1D'
+            resolution = st.selectbox('Resolution:', list(RESOLUTIONS), index=list(RESOLUTIONS).index(st.session_state['resolution']))
 
     if symbol:
         st.session_state['symbol'] = symbol.upper()
         st.session_state['days_away'] = days_away
-        df, returns = retrieve_data(symbol, days_away)
+        st.session_state['resolution'] = resolution
+        analytics = retrieve_data(symbol.upper(), days_away, resolution)
+        kelly, kelly_band, _ = size_position(analytics.key, analytics)
+        if 'position_sizing' not in st.session_state:
+            st.session_state['position_sizing'] = 1
         col1, col2 = st.columns(2)
         try:
             with col1:
                 data_selection = st.radio('Pick a plot:', ['Candlestick', 'Price', 'Returns'], horizontal=True)
                 st.subheader('Price Plots', anchor=False)
-            plot_data = graph_price_plot(df, data_selection)
+            plot_data = graph_price_plot(analytics.key, analytics, data_selection)
             st.plotly_chart(plot_data, use_container_width=True)
             col1a, col2a = st.columns(2)
             with col1a:
-                plot_histogram, plot_acf, plot_pacf, summary_df, plot_scatter = graph_col1_plots(symbol, days_away)
+                plot_histogram, plot_acf, plot_pacf, summary_df, plot_scatter = graph_col1_plots(analytics.key, analytics)
                 acf, pacf = st.columns(2)
                 with acf:
                     st.subheader('ACF', anchor=False)
@@ -98,6 +112,13 @@ with tab1:
                     st.plotly_chart(plot_pacf, use_container_width=True)
                 st.subheader("Summary Statistics:", anchor=False)
                 st.dataframe(summary_df, hide_index=True, use_container_width=True)
+                st.subheader('Position Sizing', anchor=False)
+                st.metric('Kelly fraction', f'{kelly:.0%}',
+                          help=f'Growth-optimal share of cash per trade, 90% band {kelly_band[0]:.0%} to {kelly_band[1]:.0%}, '
+                               'holding each trade through the T+2 lockout at the Default costs. Advice only.')
+                st.session_state['position_sizing'] = st.number_input(
+                    'Share of cash per trade:', min_value=0.01, max_value=1.0, step=0.05,
+                    value=max(0.01, float(st.session_state['position_sizing'])), help='Used by `Simulate` and `Backtest`')
                 metrics = calculate_financial_metrics(symbol.upper())
                 st.subheader('Financial Statistics', anchor=False)
                 st.dataframe(metrics, use_container_width=True, height=520)
@@ -112,10 +133,6 @@ with tab1:
             tb_str = traceback.format_exception(type(e), e, e.__traceback__)
             st.error(f"{tb_str}")
 
-        position_sizing = 1  # calculate_position_sizing(st.session_state['symbol'], df['close'])
-        if 'position_sizing' not in st.session_state:
-            st.session_state['position_sizing'] = 1
-        st.session_state['position_sizing'] = position_sizing
         if len(symbol) == 3:
             with col0:
                 name, basic_df = show_basic_data(st.session_state['symbol'])
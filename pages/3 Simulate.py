@@ -4,8 +4,8 @@ import io
 import ast
 import matplotlib as plt
 import matplotlib
-from functions.plots import get_stock_data
-from functions.simulation import simulate_trading, optimize_choice, simulate_buy_hold
+from functions.simulation import simulate_trading, optimize_choice, simulate_buy_hold, walk_forward
+from functions.costs import COST_MODELS
 
 st.set_page_config(layout="wide",
                    page_title='Stock Simulation')
@@ -50,15 +50,13 @@ def draw_data(column, stats, choice, plot) -> None:
     st.pyplot(plot)
     cola, colb, colc = st.columns(3)
     with cola:
-        baseline0 = simulate_buy_hold(st.session_state['symbol'], st.session_state['days_away'])
+        baseline0 = simulate_buy_hold(st.session_state['symbol'], st.session_state['days_away'], resolution)
         st.metric(label='Buy and Hold', value=f'{baseline0*100:.2f}%',
                   delta=f'{(stats["Return"] - baseline0)*100:.2f}%', help='Buy at the very start and sell at the very end')
     with colc:
         with st.expander('Assumptions:'):
-            st.write('Taxes account for `0.1%`')
-            st.write('Transaction fees account for `0.25%`')
-            st.write('Share will return after `2` days when buying')
-            st.write('Money will return after `2` days when selling')
+            for line in costs.assumptions():
+                st.write(line)
             # st.write('Expected market return: `15%`')
             # st.write('Risk-free rate: `4.5%`')
             st.write(f'Position sizing: `{st.session_state["position_sizing"]*100:.2f}%`')
@@ -72,7 +70,8 @@ else:
     with col1:
         st.title('Strategy Simulation', anchor=False)
         st.caption('Pick a trading strategy and simulate trading on the data in `Analyze`')
-        st.write(f"Simulating buy and selling `{st.session_state['symbol'].upper()}` within the last `{st.session_state['days_away']}` days")
+        resolution = st.session_state.get('resolution', '1D')
+        st.write(f"Simulating buy and selling `{st.session_state['symbol'].upper()}` within the last `{st.session_state['days_away']}` days on `{resolution}` bars")
         col1s, col2s = st.columns(2)
         with col1s:
             choice = st.selectbox('Pick a Strategy', options=["Random", "Momentum", 'Mean Reversion', 'ARIMA'], label_visibility='collapsed', placeholder='Pick a Strategy', index=None)
@@ -80,26 +79,40 @@ else:
             period = st.slider('Pick a lookback period', min_value=1, max_value=30) if (choice == 'Momentum' or choice == 'Mean Reversion') else None
             params = st.text_input('Pick ARIMA parameters (p,d,q)', placeholder="p,d,q") if choice == 'ARIMA' else '0,0,0'
             order = handle_ARIMA_params(params)
+            costs = COST_MODELS[st.selectbox('Costs', options=list(COST_MODELS), help='Fees, taxes, lot size, price band and settlement the trades pay for')]
 
         with col2s:
             Simulate = st.button('Simulate')
             st.write('')
             st.write('')
-            Auto = st.button('Auto', help='Auto generate the best period for returns') if (choice == 'Momentum' or choice == 'Mean Reversion') else None
+            Auto = st.button('Auto', help='Auto generate the best period (or ARIMA order) for returns') if choice in ('Momentum', 'Mean Reversion', 'ARIMA') else None
+            Walk = st.button('Walk-forward', help='Pick the period on each of 10 windows and trade it on the next one, so no result has seen its own data') if choice in ('Momentum', 'Mean Reversion', 'ARIMA') else None
     if Simulate:
         if choice is None:
             with col1s:
                 st.error('Please pick a Strategy before running the simulation')
         else:
-            plot, stats = simulate_trading(choice, period, st.session_state['symbol'], st.session_state['days_away'], 100_000_000, order, st.session_state['position_sizing'], verbose=False, plot=True)
+            plot, stats = simulate_trading(choice, period, st.session_state['symbol'], st.session_state['days_away'], 100_000_000, order, st.session_state['position_sizing'], verbose=False, plot=True, resolution=resolution, costs=costs)
             st.session_state['period'] = period
+            st.session_state['order'] = order
             draw_data(col2, stats, choice, plot)
     if Auto:
-        df = get_stock_data(st.session_state['symbol'], days_away=st.session_state['days_away'])
-        best_period = optimize_choice(choice, st.session_state['symbol'], st.session_state['days_away'], st.session_state['position_sizing'])
-        st.session_state['period'] = best_period
-        plot, stats = simulate_trading(choice, best_period, st.session_state['symbol'], st.session_state['days_away'], 100_000_000, order, st.session_state['position_sizing'], verbose=False, plot=True)
+        best = optimize_choice(choice, st.session_state['symbol'], st.session_state['days_away'], st.session_state['position_sizing'], resolution, costs)
+        if choice == 'ARIMA':
+            order = best
+        else:
+            period = best
+        st.session_state['period'] = period
+        st.session_state['order'] = order
+        plot, stats = simulate_trading(choice, period, st.session_state['symbol'], st.session_state['days_away'], 100_000_000, order, st.session_state['position_sizing'], verbose=False, plot=True, resolution=resolution, costs=costs)
         draw_data(col2, stats, choice, plot)
+    if Walk:
+        with st.spinner('Walking forward'):
+            folds, out_of_sample = walk_forward(choice, st.session_state['symbol'], st.session_state['days_away'], position_sizing=st.session_state['position_sizing'], resolution=resolution, costs=costs)
+        st.subheader(f'Walk-forward `{choice}`', anchor=False)
+        st.metric(label='Out-of-sample Return', value=f'{out_of_sample*100:.2f}%', help='Compounded over the test windows')
+        # ARIMA orders are tuples, which st.dataframe can't show
+        st.dataframe(folds.astype({'order': str}) if choice == 'ARIMA' else folds, hide_index=True, use_container_width=True)
 
 # try:
 #     with st.sidebar:
@@ -1,32 +1,110 @@
+import time
+from contextlib import closing
+import pandas as pd
 import streamlit as st
-from functions.simulation import test_market, split_results
+from functions.simulation import split_results
+from functions.results import result_key, load_results, stale_tickers, update_results
+from functions.portfolio import portfolio_backtest, PORTFOLIO_CHOICES
 
 st.set_page_config(layout="wide",
                    page_title='Against Market')
 
 
-@st.cache_data(show_spinner='Running against `HOSE` (~5 Minutes)')
-def display_results():
-    print('1')
-    results = test_market(st.session_state['choice'], st.session_state['period'], st.session_state['days_away'])
+def draw_results(wins_slot, losses_slot, results):
     wins, losses = split_results(results)
-    col1, col2 = st.columns(2)
-    with col1:
+    with wins_slot.container():
         st.subheader(f'Won against {len(wins)} symbols')
-        st.dataframe(wins, use_container_width=True)
-    with col2:
+        st.dataframe(pd.Series(wins, name='Return', dtype=float).sort_values(ascending=False), use_container_width=True)
+    with losses_slot.container():
         st.subheader(f'Lost against {len(losses)} symbols')
-        st.dataframe(losses, use_container_width=True)
+        st.dataframe(pd.Series(losses, name='Return', dtype=float).sort_values(), use_container_width=True)
+
+
+def draw_errors(errors):
+    if errors:
+        with st.expander(f'Could not test {len(errors)} symbols'):
+            st.dataframe(errors, use_container_width=True)
+
+
+def draw_portfolio(trades, equity, stats):
+    st.subheader('One portfolio across the market', anchor=False)
+    col1, col2 = st.columns([1, 3])
+    with col1:
+        st.dataframe(pd.Series(stats, name='Portfolio'), use_container_width=True)
+    with col2:
+        st.line_chart(equity, height=300)
+    with st.expander(f'{len(trades)} trades'):
+        st.dataframe(trades, use_container_width=True, hide_index=True)
+
+
+def stored_returns(table):
+    ok = table['error'].isna()
+    return table.loc[ok, 'Return'].to_dict(), table.loc[~ok, 'error'].to_dict()
+
+
+def run_market(key):
+    # Results are kept in the result store as they arrive, so a stopped run shows what
+    # it got so far and running again only tests the symbols whose prices moved since.
+    with st.spinner('Checking which symbols changed'):
+        tickers = stale_tickers(key)
+    results, errors = stored_returns(load_results(key))
+    total = len(tickers)
+    progress = st.progress(0.0 if total else 1.0, text='Starting workers')
+    col1, col2 = st.columns(2)
+    wins_slot, losses_slot = col1.empty(), col2.empty()
+    started = last_draw = time.monotonic()
+    done = 0
+    with closing(update_results(key, tickers)) as stream:
+        for ticker, stats, error in stream:
+            if error is not None:
+                errors[ticker] = error
+                results.pop(ticker, None)
+            else:
+                results[ticker] = stats['Return']
+                errors.pop(ticker, None)
+            done += 1
+            now = time.monotonic()
+            if now - last_draw > 0.5 or done == total:
+                eta = (now - started) / done * (total - done)
+                progress.progress(done / total, text=f'Tested {done}/{total} changed symbols, about {eta:.0f}s left')
+                draw_results(wins_slot, losses_slot, results)
+                last_draw = now
+    progress.empty()
+    draw_results(wins_slot, losses_slot, results)
+    draw_errors(errors)
 
 
 if (('symbol' and 'days_away' and 'choice' and 'period') not in st.session_state):
     st.write('Please head on over to `Simulate` and simulate a strategy')
 else:
     st.title('Test Against Market', anchor=False)
-    st.write('Using', st.session_state['choice'], 'at', st.session_state['period'])
-    if st.button('Run'):
+    st.write('Using', st.session_state['choice'], 'at', st.session_state['period'] if st.session_state['choice'] != 'ARIMA' else st.session_state.get('order'))
+    position_sizing = st.session_state.get('position_sizing', 1)
+    key = result_key(st.session_state['choice'], st.session_state['period'], st.session_state['days_away'], position_sizing, st.session_state.get('order', 0))
+    stored = load_results(key)
+    col1b, col2b, col3b, _ = st.columns([1, 1, 1, 7])
+    with col1b:
+        run = st.button('Run' if stored.empty else 'Update', help='Only symbols whose prices changed since the stored run are tested. Long runs can be precomputed with `python -m functions.batch`')
+    with col2b:
+        # any click reruns the page, which stops a sweep that is still running
+        st.button('Stop')
+    with col3b:
+        portfolio = st.button('Portfolio', help='Trade every symbol at once from one cash pool') if key[0] in PORTFOLIO_CHOICES else None
+    if portfolio:
+        with st.spinner('Running the portfolio'):
+            st.session_state['portfolio_results'] = (key, portfolio_backtest(key[0], key[1], days_away=key[2], position_sizing=position_sizing))
+    if st.session_state.get('portfolio_results') and st.session_state['portfolio_results'][0] == key:
+        draw_portfolio(*st.session_state['portfolio_results'][1])
+    if run:
+        st.subheader('Here are the results:', anchor=False)
+        run_market(key)
+    elif not stored.empty:
         st.subheader('Here are the results:', anchor=False)
-        display_results()
+        st.caption(f'Stored results for {len(stored)} symbols, press `Update` to test the symbols whose prices changed')
+        results, errors = stored_returns(stored)
+        col1, col2 = st.columns(2)
+        draw_results(col1.empty(), col2.empty(), results)
+        draw_errors(errors)
 
 # try:
 #     with st.sidebar: